@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+数据文件读取和解析的基准测试
+
+每项取 -n 次中最快的一次(秒), 结果连同时间, git提交, python版本追加到
+results文件(jsonl). 指定 compare 选项时与该文件中同一数据文件的上一次结果
+比较, 有一项慢了超过threshold则返回1, 可用于发现datafile.py, datatype.py
+的性能退化. 测试的是文件已在页缓存中的情况.
+
+benchmarks:
+  open        打开文件, 读取并解析头部
+  read        读取100只随机股票的全部数据
+  scan        items()遍历全部股票的全部数据
+  scancompact 同scan, 数据类为Compact版本
+  array       getfilearray()整体解析为numpy数组
+  cli         emdfparse -a 输出全部数据到/dev/null, 子进程计时
+  xint32      解析100万个XInt32, 逐个查表
+  xint32array 同xint32, numpy向量化
+
+Usage:
+  bench.py -t <type> [options] <filename>
+
+Options:
+  -t <type>             file type ( d| m| h| b ) d: Day, m: Minute, h: HisMin, b: Bargain
+  -n <repeat>           repeat times of each benchmark [default: 3]
+  --only <names>        comma separated benchmarks to run, all by default
+  --results <file>      jsonl file results are appended to, benchmarks/results.jsonl
+                        in the repository by default
+  --label <label>       label saved with the results
+  --compare             compare with the last results of the same data file
+  --threshold <ratio>   slowdown ratio reported as regression [default: 0.1]
+
+Examples:
+  python benchmarks/gendata.py -t d /tmp/Day.dat
+  python benchmarks/bench.py -t d --compare /tmp/Day.dat
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import subprocess
+from docopt import docopt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 缺省的结果文件, 与运行时的当前目录无关
+RESULTS = os.path.join(ROOT, 'benchmarks', 'results.jsonl')
+sys.path.insert(0, ROOT)
+
+from emdfparse.datafile import DataFile
+from emdfparse.datatype import Day, Minute, HisMin, Bargain, compactclass, \
+    xint32values, np
+
+
+clstype = {
+    'd': Day,
+    'm': Minute,
+    'h': HisMin,
+    'b': Bargain,
+}
+
+
+def bestof(func, repeat):
+    """执行repeat次, 返回最短耗时秒数"""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def consume(items):
+    for goodsid, tms in items:
+        for d in tms:
+            pass
+
+
+def benchmarks(filename, filetype):
+    """返回 (名称, 无参函数) 列表, 不可用的项(如没有numpy)不在其中"""
+    datacls = clstype[filetype]
+    df = DataFile(filename, datacls)
+    goodsids = sorted(df.goodsidx)
+    sample = random.Random(1).sample(goodsids, min(100, len(goodsids)))
+    compactcls = compactclass(datacls)
+    rawvalues = [random.Random(2).getrandbits(32) for i in range(1000000)]
+    cmd = [sys.executable, '-m', 'emdfparse.cli', '-t', filetype, '-a',
+           filename]
+
+    def read():
+        for goodsid in sample:
+            list(df.getgoodstms(goodsid))
+
+    def cli():
+        with open(os.devnull, 'wb') as devnull:
+            subprocess.check_call(cmd, stdout=devnull, cwd=ROOT)
+
+    items = [
+        ('open', lambda: DataFile(filename, datacls)),
+        ('read', read),
+        ('scan', lambda: consume(df.items())),
+        ('scancompact',
+         lambda: consume(DataFile(filename, compactcls).items())),
+    ]
+    if np is not None:
+        items.append(('array', lambda: df.getfilearray()))
+    items.append(('cli', cli))
+    items.append(('xint32', lambda: xint32values(rawvalues)))
+    if np is not None:
+        rawarray = np.array(rawvalues, dtype=np.uint32)
+        items.append(('xint32array', lambda: xint32values(rawarray)))
+    return items
+
+
+def gitcommit():
+    try:
+        out = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def loadresults(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(current, previous, threshold):
+    """打印与上一次结果的对比, 返回退化的项目名list"""
+    regressions = []
+    print('compared with {0} ({1})'.format(
+        previous['time'], previous.get('commit')))
+    for name, seconds in sorted(current['results'].items()):
+        old = previous['results'].get(name)
+        if not old:
+            continue
+        ratio = seconds / old - 1
+        mark = ''
+        if ratio > threshold:
+            mark = '  REGRESSION'
+            regressions.append(name)
+        print('  {0:<12} {1:>10.4f} {2:>10.4f} {3:>+8.1%}{4}'.format(
+            name, old, seconds, ratio, mark))
+    return regressions
+
+
+def main():
+    arguments = docopt(__doc__)
+    filename = arguments['<filename>']
+    filetype = arguments['-t']
+    repeat = int(arguments['-n'])
+    only = arguments['--only']
+    only = set(only.split(',')) if only else None
+    resultsfile = arguments['--results'] or RESULTS
+
+    results = {}
+    for name, func in benchmarks(filename, filetype):
+        if only and name not in only:
+            continue
+        results[name] = bestof(func, repeat)
+        print('{0:<12} {1:>10.4f}s'.format(name, results[name]))
+        sys.stdout.flush()
+
+    record = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': gitcommit(),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'label': arguments['--label'],
+        'file': os.path.basename(filename),
+        'type': filetype,
+        'size': os.path.getsize(filename),
+        'results': results,
+    }
+    # 只与同一台机器上同一数据文件的结果比较
+    key = ('machine', 'file', 'type', 'size')
+    history = [r for r in loadresults(resultsfile)
+               if [r.get(k) for k in key] == [record[k] for k in key]]
+    with open(resultsfile, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    if arguments['--compare'] and history:
+        regressions = compare(record, history[-1],
+                              float(arguments['--threshold']))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
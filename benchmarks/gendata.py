@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+生成用于基准测试的数据文件, 需要numpy
+
+每只股票的记录数在 [0, 2 * <records>] 内随机, 时间按数据类的timekey递增, 格式
+同实际文件(Minute, HisMin为 YYMMDDHHMM, 部分Bargain的date为0, 见filltime),
+价格为随机游走, XInt32字段为按XInt32编码的随机量(含指数不为0的大数).
+指定 --fragment K 时各股票的数据块每K块交替分配, 模拟边写边分配的碎片文件.
+
+Usage:
+  gendata.py -t <type> [options] <outfile>
+
+Options:
+  -t <type>         file type ( d| m| h| b ) d: Day, m: Minute, h: HisMin, b: Bargain
+  --version <ver>   file version, 1: EM_DataFile (8K blocks), 2: EM_DataFile2 (64K blocks) [default: 1]
+  --goods <num>     number of goods [default: 21840]
+  --records <num>   average records of each good, defaults by type: d 250, m 240, h 240, b 4800
+  --fragment <k>    interleave block chains of all goods every <k> blocks, 0 for contiguous [default: 0]
+  --seed <seed>     random seed [default: 1]
+
+Examples:
+  gendata.py -t d Day.dat
+  gendata.py -t b --records 20000 --fragment 1 Bargain.dat
+  gendata.py -t h --version 2 --fragment 4 HisMin.dat
+"""
+
+import os
+import sys
+import threading
+import numpy as np
+from docopt import docopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from emdfparse.datafile import DataFileBuilder, DataFileHead, packblocks, \
+    safewrite, DF_BLOCK_SIZE, DF2_BLOCK_SIZE, DF_MAX_GOODSUM, \
+    SIZEOF_DATA_FILE_HEAD
+from emdfparse.datatype import Day, Minute, HisMin, Bargain, npdtype, \
+    xint32encodearray
+
+
+clstype = {
+    'd': Day,
+    'm': Minute,
+    'h': HisMin,
+    'b': Bargain,
+}
+
+defaultrecords = {
+    'd': 250,
+    'm': 240,
+    'h': 240,
+    'b': 4800,
+}
+
+# 按价格随机游走生成的字段
+PRICE_FIELDS = ('open', 'high', 'low', 'close', 'price', 'ave', 'buy', 'sell')
+
+# Bargain中date为0(当日成交文件)的股票所占比例
+NODATE_RATIO = 0.2
+
+
+def yyyymmdd(days):
+    """datetime64[D]数组转为YYYYMMDD整数"""
+    years = days.astype('datetime64[Y]')
+    months = days.astype('datetime64[M]')
+    return (years.astype(np.int64) + 1970) * 10000 + \
+        (months.astype(np.int64) % 12 + 1) * 100 + \
+        (days - months).astype(np.int64) + 1
+
+
+def filltime(a, filetype, rng):
+    """按数据类型填充递增的时间字段
+
+    Day为交易日 YYYYMMDD; Minute, HisMin为交易时段内的分钟 YYMMDDHHMM, 每日
+    9:31-11:30, 13:01-15:00 共240条; Bargain为 YYYYMMDD, HHMMSS, 每日4800笔,
+    部分股票date为0, 此时只有一日的数据, 同一秒内可有多笔.
+    """
+    n = len(a)
+    if filetype == 'd':
+        days = np.busday_offset('2000-01-03', np.arange(n), roll='forward')
+        a['time'] = yyyymmdd(days)
+    elif filetype == 'b':
+        if rng.random() < NODATE_RATIO:
+            a['date'] = 0
+            seconds = 9 * 3600 + 30 * 60 + np.arange(n) * 14400 // n
+        else:
+            perday = 4800
+            days = np.busday_offset('2017-01-03', np.arange(n) // perday,
+                                    roll='forward')
+            a['date'] = yyyymmdd(days)
+            seconds = 9 * 3600 + 30 * 60 + np.arange(n) % perday * 3
+        a['time'] = seconds // 3600 * 10000 + seconds // 60 % 60 * 100 + \
+            seconds % 60
+    else:
+        perday = 240
+        days = np.busday_offset('2017-01-03', np.arange(n) // perday,
+                                roll='forward')
+        k = np.arange(n) % perday
+        minutes = np.where(k < 120, 9 * 60 + 31 + k, 13 * 60 + 1 + k - 120)
+        a['time'] = yyyymmdd(days) % 1000000 * 10000 + \
+            minutes // 60 * 100 + minutes % 60
+
+
+def genrecords(datacls, filetype, n, rng):
+    """生成一只股票n条记录的原始结构化数组"""
+    dtype = npdtype(datacls)
+    a = np.zeros(n, dtype=dtype)
+    if not n:
+        return a
+    close = rng.integers(2000, 500000) * \
+        np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    close = close.astype(np.int64)
+    for name in dtype.names:
+        shape = (n,) + dtype[name].shape
+        if name in datacls.timekey:
+            continue
+        if name in PRICE_FIELDS:
+            spread = rng.integers(0, 50, n)
+            if name == 'high':
+                a[name] = close + spread
+            elif name == 'low':
+                a[name] = np.maximum(close - spread, 1)
+            else:
+                a[name] = close
+        elif name == 'bs':
+            a[name] = rng.choice([-1, 1], n)
+        elif name.startswith('_'):
+            # 对数正态的量, 少量超过28位以覆盖XInt32的指数
+            a[name] = xint32encodearray(rng.lognormal(12, 3, shape).astype(np.int64))
+        else:
+            a[name] = rng.integers(0, 1000, shape)
+    filltime(a, filetype, rng)
+    return a
+
+
+def fragmentchains(nblocks, first, k):
+    """各只股票轮流每次分配k块, 返回每只股票的块号list
+
+    :param nblocks: 各只股票需要的块数
+    :param first:   第一个数据块号
+    """
+    chains = [[] for n in nblocks]
+    remain = list(nblocks)
+    blockid = first
+    while any(remain):
+        for i, n in enumerate(remain):
+            if not n:
+                continue
+            take = min(k, n)
+            chains[i].extend(range(blockid, blockid + take))
+            blockid += take
+            remain[i] -= take
+    return chains, blockid
+
+
+def writefragmented(outfile, datacls, filetype, version, goodsids, datanums,
+                    k, rng):
+    """按fragmentchains的分配写出碎片化的数据文件"""
+    blocksize = DF2_BLOCK_SIZE if version == 2 else DF_BLOCK_SIZE
+    datasize = datacls.getsize()
+    blockdatanum = (blocksize - 4) // datasize
+    bodysize = blockdatanum * datasize
+    nblocks = [(n - 1) // blockdatanum + 1 if n else 0 for n in datanums]
+    chains, total = fragmentchains(
+        nblocks, SIZEOF_DATA_FILE_HEAD // blocksize, k)
+
+    head = DataFileHead(version)
+    head.info.version = version
+    head.info.goodsnum = len(goodsids)
+    head.info.blockstotal = head.info.blocksuse = total
+    lock = threading.RLock()
+    f = os.open(outfile, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        os.ftruncate(f, total * blocksize)
+        for index, (goodsid, n, blocks) in enumerate(
+                zip(goodsids, datanums, chains)):
+            data = genrecords(datacls, filetype, n, rng)
+            for blockid, buf in packblocks(blocks, data.tobytes(), blocksize,
+                                           bodysize):
+                safewrite(lock, f, buf, blockid * blocksize)
+            dfg = head.dfgs[index]
+            dfg.goodsid = goodsid
+            dfg.datanum = n
+            if blocks:
+                dfg.blockfirst = blocks[0]
+                dfg.blockdata = dfg.blocklast = blocks[-1]
+            if n:
+                dfg.datalastidx = int(data[datacls.timekey[0]][-1])
+        safewrite(lock, f, head.pack(), 0)
+    finally:
+        os.close(f)
+
+
+def generate(outfile, filetype, version=1, goods=DF_MAX_GOODSUM, records=None,
+             fragment=0, seed=1):
+    """生成数据文件
+
+    :param outfile:  输出文件名
+    :param filetype: d, m, h, b
+    :param version:  1 或 2
+    :param goods:    股票数量, 不超过21840
+    :param records:  每只股票平均记录数, 缺省见defaultrecords
+    :param fragment: 大于0时各股票每fragment块交替分配, 0时连续存放
+    :param seed:     随机数种子
+    :returns: 记录总数
+    """
+    datacls = clstype[filetype]
+    if records is None:
+        records = defaultrecords[filetype]
+    rng = np.random.default_rng(seed)
+    goodsids = list(range(1, min(goods, DF_MAX_GOODSUM) + 1))
+    datanums = [int(n) for n in rng.integers(0, 2 * records + 1, len(goodsids))]
+    if fragment > 0:
+        writefragmented(outfile, datacls, filetype, version, goodsids,
+                        datanums, fragment, rng)
+    else:
+        with DataFileBuilder(outfile, datacls, version) as builder:
+            builder.reserve(datanums)
+            for goodsid, n in zip(goodsids, datanums):
+                builder.add(goodsid, genrecords(datacls, filetype, n, rng))
+    return sum(datanums)
+
+
+def main():
+    arguments = docopt(__doc__)
+    records = arguments['--records']
+    total = generate(arguments['<outfile>'], arguments['-t'],
+                     int(arguments['--version']), int(arguments['--goods']),
+                     int(records) if records else None,
+                     int(arguments['--fragment']), int(arguments['--seed']))
+    size = os.path.getsize(arguments['<outfile>'])
+    print('{0}: {1} records, {2:.1f} MB'.format(
+        arguments['<outfile>'], total, size / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -20,8 +20,13 @@ usage:
 """
 
 
+import sys
 from .datafile import *
 from .datatype import *
+from .cache import SeriesCache
+from .dataset import DataSet
+if sys.version_info >= (3, 6):
+    from .aio import AsyncDataFile
 
 __author__ = "yushin"
 __version__ = "1.0.6"
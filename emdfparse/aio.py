@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import asyncio
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from .datafile import DataFile
+
+
+class AsyncDataFile:
+    """DataFile的asyncio封装
+
+    所有文件读取和解析都在有界线程池中执行, 不阻塞事件循环; 多个协程可以同时
+    请求不同股票, 并发数不超过线程数. 头部, 索引等仍由底层DataFile负责.
+
+    usage:
+
+        >>> adf = await AsyncDataFile.open('Day.dat', Day, workers=8)
+        >>> tms = await adf.getgoodstms(1)
+        >>> async for gid, tms in adf.items():
+                ...
+        >>> await adf.close()
+    """
+    def __init__(self, df, workers=4):
+        """
+        :param df:      已打开的DataFile对象
+        :param workers: 线程池大小
+        """
+        self.df = df
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(workers)
+
+    @classmethod
+    async def open(cls, filename, datacls, workers=4, **kwargs):
+        """在线程池中打开数据文件, 参数同DataFile"""
+        loop = asyncio.get_running_loop()
+        df = await loop.run_in_executor(
+            None, partial(DataFile, filename, datacls, **kwargs))
+        return cls(df, workers)
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor,
+                                    partial(func, *args, **kwargs))
+
+    async def close(self):
+        """关闭线程池, 等待在途的读取完成"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def __len__(self):
+        """股票数量, 头部已在内存中, 不需要读文件"""
+        return len(self.df)
+
+    def goodsids(self):
+        """文件中所有股票id的list"""
+        return list(self.df.goodsidx)
+
+    async def getgoodstms(self, goodsid, start=None, end=None):
+        """返回指定股票的时序数据list, 参数同DataFile.getgoodstms"""
+        return await self._run(
+            lambda: list(self.df.getgoodstms(goodsid, start, end)))
+
+    async def tail(self, goodsid, n=1):
+        """返回指定股票最新的n条数据, 见DataFile.tail"""
+        return await self._run(self.df.tail, goodsid, n)
+
+    async def getgoodsarray(self, goodsid, raw=False):
+        """返回指定股票的numpy结构化数组, 见DataFile.getgoodsarray"""
+        return await self._run(self.df.getgoodsarray, goodsid, raw)
+
+    async def getmany(self, goodsids):
+        """并发读取多只股票, 返回与goodsids顺序一致的 (goodsid, list) 列表"""
+        goodsids = list(goodsids)
+        results = await asyncio.gather(
+            *[self.getgoodstms(goodsid) for goodsid in goodsids])
+        return list(zip(goodsids, results))
+
+    async def items(self, goodsids=None):
+        """异步迭代 (goodsid, 时序数据list), 按goodsids顺序返回
+
+        同时在途的股票不超过 2 * workers 只
+
+        :param goodsids: 股票id序列, 缺省为文件中所有股票
+        """
+        if goodsids is None:
+            goodsids = self.goodsids()
+        pending = deque()
+        try:
+            for goodsid in goodsids:
+                pending.append((goodsid, asyncio.ensure_future(
+                    self.getgoodstms(goodsid))))
+                if len(pending) >= self.workers * 2:
+                    goodsid, future = pending.popleft()
+                    yield goodsid, await future
+            while pending:
+                goodsid, future = pending.popleft()
+                yield goodsid, await future
+        finally:
+            for goodsid, future in pending:
+                future.cancel()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+class SeriesCache:
+    """按字节预算以LRU淘汰的已解析时序数据缓存, 可由多个DataFile共享
+
+    键为 (文件标识(st_dev, st_ino), 数据类, goodsid), 每个键只保存一份数据,
+    同时记下读取时头部的 (datanum, blocklast, blockfirst, datalastidx). 取数据
+    时头部已变化(refresh后其他进程写入了新数据, 或本进程写入)则丢弃该项.
+    同一文件无论以什么路径打开, 文件标识都相同, 共享缓存项.
+
+    缓存的记录对象由所有取到它的调用者共享, 不应修改; 需要修改时用Compact
+    数据类之外的对象前先复制.
+
+    usage:
+
+        >>> cache = SeriesCache(256 * 1024 * 1024)
+        >>> df1 = DataFile('Day.dat', Day, cache=cache)
+        >>> df2 = DataFile('Day.dat', Day, cache=cache)
+        >>> df1[1]; df2[1]      # 第二次不再读文件
+        >>> cache.stats()
+    """
+    def __init__(self, maxbytes=64 * 1024 * 1024):
+        """
+        :param maxbytes: 字节预算, 按记录对象估算的大小计
+        """
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._recordsizes = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, stamp):
+        """返回缓存的记录list, 没有或stamp不同时返回None(后者同时丢弃该项)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != stamp:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, stamp, records):
+        """放入记录list, 超过预算时淘汰最久未使用的项; 单项超过预算时不缓存"""
+        size = self.sizeof(records)
+        if size > self.maxbytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (stamp, records, size)
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def discard(self, key):
+        """丢弃一项, 不存在时忽略"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _remove(self, key):
+        stamp, records, size = self._entries.pop(key)
+        self.nbytes -= size
+
+    def sizeof(self, records):
+        """估算记录list占用的字节数, 每个数据类以第一条记录测量一次"""
+        size = sys.getsizeof(records)
+        if not records:
+            return size
+        cls = type(records[0])
+        recordsize = self._recordsizes.get(cls)
+        if recordsize is None:
+            recordsize = self._recordsizes[cls] = _deepsizeof(records[0])
+        return size + recordsize * len(records)
+
+    def stats(self):
+        """命中, 未命中, 淘汰次数及当前项数和字节数"""
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, entries=len(self._entries),
+                        nbytes=self.nbytes, maxbytes=self.maxbytes)
+
+
+def _deepsizeof(obj):
+    """记录对象及其__dict__, 属性值(含list元素)的大小之和"""
+    size = sys.getsizeof(obj)
+    values = list(obj) if isinstance(obj, tuple) else []
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+        values = list(attrs.values())
+    for value in values:
+        size += sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+
+_defaultcache = None
+_defaultlock = threading.Lock()
+
+
+def defaultcache():
+    """进程内共享的SeriesCache, DataFile(..., cache=True) 时使用"""
+    global _defaultcache
+    with _defaultlock:
+        if _defaultcache is None:
+            _defaultcache = SeriesCache()
+        return _defaultcache
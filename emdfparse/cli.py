@@ -6,10 +6,18 @@ emdfparse
 
 Usage:
   emdfparse -h | --help | --version
-  emdfparse -t <type> (-c| -a| -l| -i <goodsid>) <filename>
+  emdfparse -t <type> (-c| -l) [-j <processes>] [--stats] <filename>...
+  emdfparse -t <type> (-a| -i <goodsid>) [-n <num>] [--format <fmt>] [--fields <fields>] [-j <processes>] [--stats] <filename>...
+  emdfparse -t <type> -f [--interval <seconds>] [--format <fmt>] [--fields <fields>] [--stats] <filename>
+  emdfparse -t <type> compact [--stats] <filename> <outfile>
+  emdfparse -t <type> export [--format <fmt>] [-j <processes>] [--stats] <filename> <outfile>
 
 Arguments:
-  filename          name of data file
+  filename          name of data file, several names or glob patterns like 'Bargain.dat_*'
+                    are allowed with -c, -l, -a and -i, output of each file is tagged
+                    with its name, and -c also outputs goods and records in total
+  outfile           name of the defragmented data file written by compact,
+                    or output directory (npy) / file (arrow, parquet) of export
 
 Options:
   -h --help         show help
@@ -19,72 +27,293 @@ Options:
   -a                ouput all goods time data in file
   -l                list goods id in file
   -i <goodsid>      output the time data of specified good
+  -n <num>          with -a or -i, output only the latest <num> records of each good
+  -f                follow a file being written, output new records as they are appended
+  --interval <seconds>  polling interval of -f [default: 1]
+  --format <fmt>    output format ( text| csv| jsonl| binary ), text by default;
+                    binary with a single <filename> only;
+                    export format ( npy| arrow| parquet ), npy by default
+  --fields <fields> comma separated fields to output, brief fields of <type> by default
+  -j <processes>    number of worker processes for several files, or decoding
+                    processes of export
+  --stats           print I/O and decode statistics of each file to stderr
 """
 
+import os
 import sys
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import emdfparse
 from .datafile import DataFile
+from .dataset import expandpattern
 from .datatype import *
-from docopt import docopt
+from .output import RecordWriter
+from docopt import docopt, DocoptExit
+
+
+# 命令行数据类型标识 => 数据类
+clstype = {
+    "d": Day,
+    "m": Minute,
+    "h": HisMin,
+    "b": Bargain,
+}
+
+# 输出时记录只需按字段取值, 用紧凑的元组记录类
+compacttype = {
+    "d": CompactDay,
+    "m": CompactMinute,
+    "h": CompactHisMin,
+    "b": CompactBargain,
+}
 
 
 class DfInfo:
-    def __init__(self, filename, datacls):
+    def __init__(self, filename, datacls, outformat="text", fields=None,
+                 out=None, tagged=False, header=True):
+        """
+        :param out:    二进制输出流, 缺省为标准输出
+        :param tagged: 输出多个文件时, 是否以文件名标记输出
+        :param header: csv格式是否输出表头
+        """
         self.df = DataFile(filename, datacls)
+        self.filename = filename
+        self.outformat = outformat
+        self.fields = fields
+        self.out = sys.stdout.buffer if out is None else out
+        self.tagged = tagged
+        self.header = header
+
+    def _writer(self):
+        # 记录为Compact类的元组, 由RecordWriter按批格式化
+        return RecordWriter(self.out, self.df.datacls,
+                            self.outformat, self.fields,
+                            filename=self.filename if self.tagged else None,
+                            header=self.header)
+
+    def goodscount(self):
+        """(股票数量, 记录总数)"""
+        datanums = self.df.head.dfgs.column(1)
+        return len(self.df), sum(datanums[i] for i in self.df.goodsidx.values())
+
+    def printstats(self):
+        sys.stderr.write("stats of {0}:\n{1}\n".format(
+            self.filename, self.df.stats()))
 
     def printgoodscount(self):
-        print(len(self.df))
+        self.out.write("{0}\n".format(len(self.df)).encode())
 
     def printgoodsids(self):
-        for gid in self.df:
-            print(gid)
+        lines = ["{0}\n".format(gid) for gid in self.df]
+        if self.tagged:
+            lines.insert(0, "file:{0}\n".format(self.filename))
+        self.out.write("".join(lines).encode())
+        self.out.flush()
 
     def printgoodsbyid(self, gid):
-        for d in self.df[gid]:
-            print(d)
+        with self._writer() as writer:
+            writer.write(gid, self.df[gid], tag=False)
 
     def printgoodsall(self):
-        for gid, tms in self.df.items():
-            print("id:{0}".format(gid))
-            for d in tms:
-                print(d)
+        with self._writer() as writer:
+            for gid, tms in self.df.items():
+                writer.write(gid, tms)
 
+    def printgoodstail(self, gid, num):
+        with self._writer() as writer:
+            writer.write(gid, self.df.tail(gid, num), tag=False)
 
-def main():
-    arguments = docopt(__doc__, version="emdfparse {0}".format(emdfparse.__version__))
-    # 取得各个命令行参数及选项值
-    filename = arguments["<filename>"]
+    def printgoodsalltail(self, num):
+        with self._writer() as writer:
+            for gid in self.df:
+                writer.write(gid, self.df.tail(gid, num))
+
+    def printfollow(self, interval):
+        with self._writer() as writer:
+            for gid, tms in self.df.follow(interval=interval):
+                writer.write(gid, tms)
+                writer.flush()
+
+
+def expandfiles(patterns):
+    """展开文件名中的通配符, 按文件名自然顺序排序; 没有匹配的保持原样, 打开时报错"""
+    filenames = []
+    for pattern in patterns:
+        filenames.extend(expandpattern(pattern) or [pattern])
+    return filenames
+
+
+def runfile(arguments, filename, out=None, tagged=False, header=True):
+    """对一个文件执行 -c, -l, -a, -i 命令
+
+    :returns: 指定 -c 且tagged时返回 (股票数量, 记录总数), 由调用者汇总输出
+    """
     filetype = arguments["-t"]
-    outputcounts = arguments["-c"]
-    outputids = arguments["-l"]
-    outputall = arguments["-a"]
+    fields = arguments["--fields"]
+    tailnum = arguments["-n"]
     goodsid = arguments["-i"]
-    # 命令行数据类型标识 => 数据类
-    clstype = {
-        "d": Day,
-        "m": Minute,
-        "h": HisMin,
-        "b": Bargain,
-    }
-    datacls = clstype[filetype]
-    dfinfo = DfInfo(filename, datacls)
+    dfinfo = DfInfo(filename, compacttype[filetype],
+                    arguments["--format"] or "text",
+                    fields.split(",") if fields else None,
+                    out, tagged, header)
 
+    result = None
     # 指定 -c
-    if outputcounts:
-        dfinfo.printgoodscount()
+    if arguments["-c"]:
+        if tagged:
+            result = dfinfo.goodscount()
+        else:
+            dfinfo.printgoodscount()
 
     # 指定 -l
-    elif outputids:
+    elif arguments["-l"]:
         dfinfo.printgoodsids()
 
-    # 指定 -a
-    elif outputall:
-        dfinfo.printgoodsall()
+    # 指定 -a [-n <num>]
+    elif arguments["-a"]:
+        if tailnum:
+            dfinfo.printgoodsalltail(int(tailnum))
+        else:
+            dfinfo.printgoodsall()
 
-    # 指定 -i <goodsid>
+    # 指定 -i <goodsid> [-n <num>]
     elif goodsid:
         gid = int(goodsid)
-        dfinfo.printgoodsbyid(gid)
+        if tailnum:
+            dfinfo.printgoodstail(gid, int(tailnum))
+        else:
+            dfinfo.printgoodsbyid(gid)
+
+    if arguments["--stats"]:
+        dfinfo.printstats()
+    return result
+
+
+def _runtask(task):
+    """进程池中处理一个文件, 输出写到tmpdir下的临时文件, 返回其文件名;
+    -c 时返回计数, 见runfile"""
+    arguments, filename, header, tmpdir = task
+    fd, path = tempfile.mkstemp(dir=tmpdir)
+    with os.fdopen(fd, "wb") as out:
+        result = runfile(arguments, filename, out, True, header)
+    if result is None:
+        return path
+    os.remove(path)
+    return result
+
+
+def _runpool(arguments, filenames, processes, tmpdir):
+    """在进程池中处理多个文件, 按文件顺序生成_runtask的结果
+
+    与DataFile.getmany相同, 同时在途的文件不超过 2 * processes 个, 已完成但
+    未写出的输出在临时文件中, 不占用内存
+    """
+    pending = deque()
+    with ProcessPoolExecutor(processes) as pool:
+        try:
+            for index, filename in enumerate(filenames):
+                pending.append(pool.submit(
+                    _runtask, (arguments, filename, index == 0, tmpdir)))
+                if len(pending) >= processes * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def runfiles(arguments, filenames, processes):
+    """处理多个文件, 输出按文件名顺序, 以文件名标记; -c 最后输出合计
+
+    processes大于1时每个文件在进程池中处理, 输出先写到临时文件, 再按顺序
+    复制到标准输出
+    """
+    out = sys.stdout.buffer
+    tmpdir = None
+    if processes > 1:
+        tmpdir = tempfile.mkdtemp(prefix="emdfparse-")
+        results = _runpool(arguments, filenames, processes, tmpdir)
+    else:
+        results = (runfile(arguments, filename, out, True, index == 0)
+                   for index, filename in enumerate(filenames))
+    try:
+        total = [0, 0]
+        for filename, result in zip(filenames, results):
+            if isinstance(result, str):
+                with open(result, "rb") as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+                os.remove(result)
+                out.flush()
+            elif result is not None:
+                total[0] += result[0]
+                total[1] += result[1]
+                out.write("{0:>8} {1:>12} {2}\n".format(
+                    result[0], result[1], filename).encode())
+        if arguments["-c"]:
+            out.write("{0:>8} {1:>12} total\n".format(*total).encode())
+            out.flush()
+    finally:
+        results.close()
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    arguments = docopt(__doc__, version="emdfparse {0}".format(emdfparse.__version__))
+    # 取得各个命令行参数及选项值
+    filenames = expandfiles(arguments["<filename>"])
+    filetype = arguments["-t"]
+    follow = arguments["-f"]
+    interval = float(arguments["--interval"])
+    compact = arguments["compact"]
+    export = arguments["export"]
+    outfile = arguments["<outfile>"]
+    outformat = arguments["--format"]
+    fields = arguments["--fields"]
+    processes = int(arguments["-j"] or 0)
+    stats = arguments["--stats"]
+
+    # compact <filename> <outfile>
+    if compact:
+        dfinfo = DfInfo(filenames[0], clstype[filetype])
+        try:
+            dfinfo.df.compact(outfile)
+        except ValueError as e:
+            sys.stderr.write("{0}: {1}\n".format(filenames[0], e))
+            sys.exit(1)
+        if stats:
+            dfinfo.printstats()
+
+    # export <filename> <outfile>
+    elif export:
+        dfinfo = DfInfo(filenames[0], clstype[filetype])
+        dfinfo.df.export(outfile, outformat or "npy", processes)
+        if stats:
+            dfinfo.printstats()
+
+    # 指定 -f
+    elif follow:
+        dfinfo = DfInfo(filenames[0], compacttype[filetype],
+                        outformat or "text",
+                        fields.split(",") if fields else None)
+        try:
+            dfinfo.printfollow(interval)
+        except KeyboardInterrupt:
+            pass
+        if stats:
+            dfinfo.printstats()
+
+    # 多个文件 -c, -l, -a, -i
+    elif len(filenames) > 1:
+        if outformat == "binary":
+            raise DocoptExit("--format binary accepts only one <filename>")
+        runfiles(arguments, filenames, processes)
+
+    else:
+        runfile(arguments, filenames[0])
 
 if __name__ == '__main__':
     main()
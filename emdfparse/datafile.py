@@ -4,11 +4,23 @@
 
 import os
 import sys
+import mmap
+import time
 import struct
 import ctypes
 import platform
 import threading
 import traceback
+import weakref
+from array import array
+from operator import itemgetter, attrgetter
+from itertools import islice, takewhile, dropwhile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .datatype import np, npdtype, nparray
+from .export import exportnpy, exportarrow, exportparquet
+from .cache import defaultcache
 
 
 DATAFILE_HEADER = "EM_DataFile"
@@ -17,6 +29,7 @@ DF_BLOCK_SIZE = 8192
 DF2_BLOCK_SIZE = 65536
 DF_BLOCK_GROWBY = 64
 DF_MAX_GOODSUM = 21840
+DF_READAHEAD_SIZE = 4 * 1024 * 1024
 SIZEOF_DATA_FILE_INFO = 0x100
 SIZEOF_DATA_FILE_GOODS = 0x30
 SIZEOF_DATA_FILE_HEAD = SIZEOF_DATA_FILE_INFO + \
@@ -24,6 +37,9 @@ SIZEOF_DATA_FILE_HEAD = SIZEOF_DATA_FILE_INFO + \
 
 LEN_STOCKCOE = 24
 
+INDEX_SUFFIX = '.emidx'
+INDEX_MAGIC = b'EMIDX001'
+
 
 _IS_WINDOWS = True if platform.system() == 'Windows' else False
 _IS_PY2 = True if platform.python_version_tuple()[0] == '2' else False
@@ -60,6 +76,72 @@ def safewrite(lock, fd, data, offset):
         return  os.pwrite(fd, data, offset)
 
 
+def packrecords(datacls, tms):
+    """把时序数据打包为连续的原始记录数据
+
+    :param datacls: 数据类
+    :param tms:     数据对象序列; 或原始记录数据(bytes等); 或保留XInt32原始值的
+                    numpy结构化数组, 即getgoodsarray(raw=True)的结果
+    :returns: 原始记录数据
+    """
+    if isinstance(tms, (bytes, bytearray, memoryview)):
+        return tms
+    if np is not None and isinstance(tms, np.ndarray):
+        if tms.dtype != npdtype(datacls):
+            raise TypeError('numpy array must have the raw dtype of {0}, '
+                            'see getgoodsarray(raw=True)'.format(datacls.__name__))
+        return tms.tobytes()
+    return b''.join([d.pack() for d in tms])
+
+
+def packblocks(blocks, data, blocksize, bodysize, nextblockid=0):
+    """把连续的原始记录数据按块拼好, 生成 (起始块号, 数据) 元组
+
+    每块为下一块号加块内数据, 物理相邻的块拼接在一起以便一次写入, 每段不超过
+    DF_READAHEAD_SIZE.
+
+    :param blocks:      块号列表
+    :param data:        原始记录数据
+    :param blocksize:   数据块大小
+    :param bodysize:    每块存放的数据长度
+    :param nextblockid: 最后一块的下一块号
+    """
+    maxrun = max(1, DF_READAHEAD_SIZE // blocksize)
+    data = memoryview(data)
+    i = 0
+    while i < len(blocks):
+        j = i + 1
+        while (j < len(blocks) and j - i < maxrun
+               and blocks[j] == blocks[j - 1] + 1):
+            j += 1
+        buf = bytearray()
+        for k in range(i, j):
+            nb = blocks[k + 1] if k + 1 < len(blocks) else nextblockid
+            body = data[k * bodysize:(k + 1) * bodysize]
+            buf += struct.pack('I', nb)
+            buf += body
+            if k < j - 1:
+                buf += b'\x00' * (blocksize - 4 - len(body))
+        yield blocks[i], bytes(buf)
+        i = j
+
+
+def _shardarray(task):
+    """进程池任务: 在子进程中重新打开数据文件, 解析一个分片的股票
+
+    :param task: (filename, datacls, goodsids, raw, outfile, openargs) 元组
+    :returns: outfile为None时返回 (goodsids, offsets, data), 否则写出npz
+              文件并返回文件名
+    """
+    filename, datacls, goodsids, raw, outfile, openargs = task
+    df = DataFile(filename, datacls, **openargs)
+    ids, offsets, data = df.getfilearray(goodsids, raw)
+    if outfile is None:
+        return ids, offsets, data
+    np.savez(outfile, goodsids=ids, offsets=offsets, data=data)
+    return outfile
+
+
 class DataFileInfo:
     """对应CPP中CDataFileInfo"""
     fmt = '32s4I208s'
@@ -141,11 +223,67 @@ class DataFileGoods:
         )
 
 
+class DataFileGoodsList:
+    """DataFileHead.dfgs, 惰性的DataFileGoods序列
+
+    原始数据整体保存, 只有按下标访问到的元素才构造DataFileGoods对象;
+    goodsid, datanum 等整数字段可通过column()整列取出, 无需逐个解析.
+    """
+    # 每个DataFileGoods中32位整数个数, 6I + 24s
+    _WORDS = SIZEOF_DATA_FILE_GOODS // 4
+
+    def __init__(self, data=None):
+        if data is None:
+            data = b'\x00' * (SIZEOF_DATA_FILE_GOODS * DF_MAX_GOODSUM)
+        self._data = data
+        self._words = None
+        self._items = [None] * DF_MAX_GOODSUM
+
+    def __len__(self):
+        return DF_MAX_GOODSUM
+
+    def __getitem__(self, index):
+        g = self._items[index]
+        if g is None:
+            if index < 0:
+                index += DF_MAX_GOODSUM
+            start = index * SIZEOF_DATA_FILE_GOODS
+            g = DataFileGoods()
+            g.read(self._data[start:start + SIZEOF_DATA_FILE_GOODS])
+            self._items[index] = g
+        return g
+
+    def __iter__(self):
+        return (self[i] for i in range(DF_MAX_GOODSUM))
+
+    def column(self, n):
+        """整列取出第n个整数字段, 0: goodsid, 1: datanum, 2: blockfirst ...
+
+        已构造出的DataFileGoods可能被修改过, 以其当前值为准
+        """
+        if self._words is None:
+            self._words = array('I', self._data)
+        col = self._words[n::self._WORDS]
+        names = ('goodsid', 'datanum', 'blockfirst',
+                 'blockdata', 'blocklast', 'datalastidx')
+        for index, g in enumerate(self._items):
+            if g is not None:
+                col[index] = getattr(g, names[n])
+        return col
+
+    def pack(self):
+        step = SIZEOF_DATA_FILE_GOODS
+        return b''.join([
+            self._data[i * step:(i + 1) * step] if g is None else g.pack()
+            for i, g in enumerate(self._items)
+        ])
+
+
 class DataFileHead:
     """对应CPP中CDataFileHead"""
     def __init__(self, version=1):
         self.info = DataFileInfo(version)
-        self.dfgs = [DataFileGoods() for i in range(DF_MAX_GOODSUM)]
+        self.dfgs = DataFileGoodsList()
 
     def read(self, data):
         """
@@ -154,34 +292,113 @@ class DataFileHead:
 
         """
         self.info.read(data[0:SIZEOF_DATA_FILE_INFO])
-
-        start = SIZEOF_DATA_FILE_INFO
-        step = SIZEOF_DATA_FILE_GOODS
-        end = start + step
-        for g in self.dfgs:
-            g.read(data[start:end])
-            start = end
-            end += step
+        self.dfgs = DataFileGoodsList(data[SIZEOF_DATA_FILE_INFO:SIZEOF_DATA_FILE_HEAD])
 
     def pack(self):
         infodata = self.info.pack()
-        dfgsdata = b''.join([i.pack() for i in self.dfgs])
+        dfgsdata = self.dfgs.pack()
         return infodata + dfgsdata
 
 
+class DataFileStats:
+    """DataFile的IO和解析计数, 见DataFile.stats
+
+    preads:      readat调用次数, mmap模式下为映射区切片次数
+    bytesread:   readat读出的字节数
+    blocks:      读取的数据块数
+    chainjumps:  链表中下一块不紧接当前块的次数, 反映碎片化程度
+    chainbreaks: 链表在datanum条记录读完前中断的次数(块号越界或文件截断)
+    records:     解析的记录数
+    headtime:    读取和解析头部的秒数
+    iotime:      readat的秒数, mmap模式下缺页发生在解析时, 不计入
+    decodetime:  解包记录, 构造记录对象和numpy解析的秒数
+    """
+    __slots__ = ('preads', 'bytesread', 'blocks', 'chainjumps',
+                 'chainbreaks', 'records', 'headtime', 'iotime',
+                 'decodetime')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def add(self, other):
+        """原地累加other的各项计数"""
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    def __sub__(self, other):
+        diff = DataFileStats()
+        for name in self.__slots__:
+            setattr(diff, name, getattr(self, name) - getattr(other, name))
+        return diff
+
+    def copy(self):
+        return DataFileStats().add(self)
+
+    def asdict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __str__(self):
+        return (
+            "header  {0.headtime:10.4f}s\n"
+            "io      {0.iotime:10.4f}s  {0.preads} reads, {0.bytesread} bytes\n"
+            "decode  {0.decodetime:10.4f}s  {0.records} records\n"
+            "blocks  {0.blocks}, {0.chainjumps} chain jumps, "
+            "{0.chainbreaks} chain breaks"
+        ).format(self)
+
+    __repr__ = __str__
+
+
 class DataFile:
     """对应CPP中CDataFile
 
     self.goodsidx 对应CPP中m_aGoodsIndex, id => index 字典
 
+    usemmap=True 时以只读方式将文件映射到内存, readat 直接返回映射区的
+    memoryview 切片, 不再为每个数据块调用pread和复制bytes; 多个进程读同一
+    文件时共享page cache. 仅 mode='r' 有效, 映射失败(如空文件)时回退到pread.
+
+    useindex=True 时加载旁路索引文件 filename + INDEX_SUFFIX (由buildindex
+    生成), 其中记录了每只股票完整的数据块链表, 读取时不必再沿链表逐块跳转.
+    文件mtime, 大小或头部blocksuse变化时整个索引失效, 某只股票的datanum或
+    blocklast变化时该股票的索引项失效, 失效部分仍按链表读取.
+
+    mode='w' 且文件不存在时按version新建一个空数据文件, 1: EM_DataFile,
+    2: EM_DataFile2. 写入见setgoodstms, appendgoodstms.
+
+    读取和解析的计数见stats; statshook(name, stats) 在每次getgoodstms, tail,
+    poll, getgoodsarray, getfilearray完成后以该次调用的DataFileStats调用.
 
+    cache 为SeriesCache时, getgoodstms, df[gid], tail 读取整只股票的数据后
+    放入缓存, 再次读取且该股票头部未变时直接返回缓存的记录, 见SeriesCache;
+    cache=True 使用进程内共享的缺省缓存. 其他进程写入的数据在refresh后
+    可见, 缓存项同时失效. 缓存的记录对象是共享的, 不应修改.
     """
-    def __init__(self, filename, datacls, mode='r'):
+    def __init__(self, filename, datacls, mode='r', usemmap=False,
+                 useindex=False, version=1, statshook=None, cache=None):
         self.filename = filename
         self.datacls = datacls
         self.thlk = threading.RLock()
+        self.statshook = statshook
+        if cache is True:
+            cache = defaultcache()
+        self.cache = cache if cache is not False else None
+        # 各线程分别累加自己的计数器, 热路径上不加锁, stats()时汇总
+        self._statslock = threading.Lock()
+        self._statslocal = threading.local()
+        self._threadstats = []
+        self._deadstats = DataFileStats()
+        self._statsbase = DataFileStats()
         self.head = DataFileHead()
         self.goodsidx = {}
+        self._mm = None
+        self._mmview = None
+        self.blockindex = {}
+        self._chaincache = {}
+        # 子进程重新打开文件时使用的参数
+        self._openargs = dict(usemmap=usemmap, useindex=useindex)
         flag = os.O_RDWR
         if _IS_WINDOWS:
             flag |= os.O_BINARY
@@ -191,11 +408,21 @@ class DataFile:
                 self._readhead()
             elif mode == 'w':
                 self._f = os.open(self.filename, flag|os.O_CREAT)
+                self.head = DataFileHead(version)
+                blocksize = DF2_BLOCK_SIZE if version == 2 else DF_BLOCK_SIZE
+                self.head.info.version = version
+                self.head.info.blockstotal = SIZEOF_DATA_FILE_HEAD // blocksize
+                self.head.info.blocksuse = self.head.info.blockstotal
                 self._writehead()
             else:
                 print('{f} is not exist!'.format(f=filename))
                 sys.exit(1)
             self._filesize = os.path.getsize(self.filename)
+            st = os.fstat(self._f)
+            # 缓存键中的文件标识, 以不同路径打开同一文件时相同
+            self._fileid = (st.st_dev, st.st_ino)
+            if usemmap and mode == 'r':
+                self._mmap()
         except Exception as e:
             traceback.print_exc()
             sys.exit(1)
@@ -207,14 +434,38 @@ class DataFile:
             self.version = 1
         self.datasize = datacls.getsize()
         self.blockdatanum = (self.blocksize - 4) // self.datasize
+        if useindex:
+            self.loadindex()
 
     def __del__(self):
         try:
+            self._munmap()
             if hasattr(self, '_f'):
                 os.close(self._f)
         except Exception as e:
             traceback.print_exc()
 
+    def _mmap(self):
+        """只读映射整个文件, 失败时保持pread方式"""
+        try:
+            self._mm = mmap.mmap(self._f, 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            self._mm = None
+            return
+        self._mmview = memoryview(self._mm)
+
+    def _munmap(self):
+        """解除映射. 外部仍持有映射区切片时mmap无法关闭, 交给GC回收"""
+        mm, self._mm = getattr(self, '_mm', None), None
+        view, self._mmview = getattr(self, '_mmview', None), None
+        if view is not None:
+            view.release()
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                pass
+
     def __iter__(self):
         self.goodsidxiter = iter(self.goodsidx)
         return self
@@ -228,114 +479,940 @@ class DataFile:
         return goodsid
 
     def readat(self, size, offset):
-        return saferead(self.thlk, self._f, size, offset)
+        """读取文件offset处size字节, mmap模式下返回映射区的memoryview切片"""
+        stats = self._counter()
+        stats.preads += 1
+        if self._mmview is not None:
+            data = self._mmview[offset:offset + size]
+        else:
+            start = time.perf_counter()
+            data = saferead(self.thlk, self._f, size, offset)
+            stats.iotime += time.perf_counter() - start
+        stats.bytesread += len(data)
+        return data
+
+    def _counter(self):
+        """当前线程的计数器. 新线程登记计数器时, 已结束线程的计数并入_deadstats"""
+        try:
+            return self._statslocal.stats
+        except AttributeError:
+            pass
+        stats = self._statslocal.stats = DataFileStats()
+        with self._statslock:
+            alive = []
+            for thread, counter in self._threadstats:
+                if thread() is None or not thread().is_alive():
+                    self._deadstats.add(counter)
+                else:
+                    alive.append((thread, counter))
+            alive.append((weakref.ref(threading.current_thread()), stats))
+            self._threadstats = alive
+        return stats
+
+    def stats(self, reset=False):
+        """返回各线程汇总的读取和解析计数, 见DataFileStats
+
+        进程池子进程中的读取(getfilearray的processes参数)不计入.
+
+        :param reset: 返回后从0重新计数
+        :returns: DataFileStats
+        """
+        with self._statslock:
+            total = self._deadstats.copy()
+            for thread, counter in self._threadstats:
+                total.add(counter)
+            result = total - self._statsbase
+            if reset:
+                self._statsbase = total
+        return result
+
+    @contextmanager
+    def _measure(self, name):
+        """statshook不为None时, 以本次调用的计数调用statshook(name, stats)"""
+        hook = self.statshook
+        if hook is None:
+            yield
+            return
+        before = self._counter().copy()
+        try:
+            yield
+        finally:
+            hook(name, self._counter() - before)
+
+    def _measureiter(self, name, iterable):
+        """迭代完成或关闭时以整个迭代期间的计数调用statshook, 见_measure"""
+        with self._measure(name):
+            for item in iterable:
+                yield item
+
+    def _records(self, tuples):
+        """记录元组list构造为数据类对象list, 构造时间计入decodetime"""
+        start = time.perf_counter()
+        records = list(map(self.datacls.fromtuple, tuples))
+        self._counter().decodetime += time.perf_counter() - start
+        return records
 
     def writeat(self, data, offset):
         safewrite(self.thlk, self._f, data, offset)
 
-    def items(self):
-        """实现类似字典items列表方法, 生成器语法, key为goodsid, value为时序数据."""
+    def items(self, workers=None):
+        """实现类似字典items列表方法, 生成器语法, key为goodsid, value为时序数据.
+
+        :param workers: 大于1时用线程池并发读取, 见getmany, 此时value为list
+        """
+        if workers and workers > 1:
+            return self.getmany(list(self.goodsidx), workers)
         return ((i, self.getgoodstms(i)) for i in self)
 
+    def getmany(self, goodsids, workers=None):
+        """读取多只股票的时序数据, 生成 (goodsid, 时序数据list) 元组
+
+        workers大于1时用线程池并发读取和解析. python3 下pread不持有GIL,
+        多个线程可同时等待IO. 结果按goodsids的顺序返回, 同时在途的股票
+        不超过 2 * workers 只, 内存占用有界. 读取中的异常在取到对应结果时
+        原样抛出, 剩余未开始的任务被取消.
+
+        :param goodsids: 股票id序列
+        :param workers:  线程数
+        """
+        if not workers or workers <= 1:
+            for goodsid in goodsids:
+                yield goodsid, self[goodsid]
+            return
+        pending = deque()
+        with ThreadPoolExecutor(workers) as pool:
+            try:
+                for goodsid in goodsids:
+                    pending.append((goodsid, pool.submit(self.__getitem__, goodsid)))
+                    if len(pending) >= workers * 2:
+                        goodsid, future = pending.popleft()
+                        yield goodsid, future.result()
+                while pending:
+                    goodsid, future = pending.popleft()
+                    yield goodsid, future.result()
+            finally:
+                for goodsid, future in pending:
+                    future.cancel()
+
+    def _walkchain(self, goodsid):
+        """沿链表读取一只股票的数据块, 生成 (blockid, 块内数据) 元组.
+
+        每块一次读取, 块头的下一块号和块内数据一起读出. 链表连续时合并读取:
+        读到缓冲区以外时若下一块紧接缓冲区, 预读块数翻倍(不超过
+        DF_READAHEAD_SIZE), 否则退回单块读取. 连续存放的链表只需对数次读取,
+        碎片化的链表每块一次读取. 块内数据是读缓冲区的memoryview切片.
+
+        :param goodsid: 股票id
+        """
+        dfg = self.head.dfgs[self.goodsidx[goodsid]]
+        blocksize = self.blocksize
+        blockdatanum = self.blockdatanum
+        datasize = self.datasize
+        remain = dfg.datanum
+        blockid = dfg.blockfirst
+        maxahead = max(1, DF_READAHEAD_SIZE // blocksize)
+        ahead = maxahead if self._mmview is not None else 1
+        stats = self._counter()
+        buf = memoryview(b'')
+        bufstart = bufend = -1
+        while remain > 0:
+            num = min(remain, blockdatanum)
+            pos = (blockid - bufstart) * blocksize
+            # 缓冲区大小按链表从bufstart起物理连续估算, 链表在缓冲区内跳过
+            # 某些块时, 落在缓冲区中的块可能只读了一部分, 此时从该块重新读取
+            if not bufstart <= blockid < bufend or \
+                    pos + 4 + num * datasize > len(buf):
+                if blockid == bufend or self._mmview is not None:
+                    ahead = min(ahead * 2, maxahead)
+                else:
+                    ahead = 1
+                nblocks = min(ahead, (remain - 1) // blockdatanum + 1)
+                lastnum = min(remain - (nblocks - 1) * blockdatanum,
+                              blockdatanum)
+                size = (nblocks - 1) * blocksize + 4 + lastnum * datasize
+                buf = memoryview(self.readat(size, blockid * blocksize))
+                bufstart, bufend = blockid, blockid + nblocks
+                pos = 0
+            if pos + 4 + num * datasize > len(buf):
+                # 文件在块中间结束
+                stats.chainbreaks += 1
+                break
+            nextblockid, = struct.unpack_from('I', buf, pos)
+            if nextblockid > dfg.blocklast:
+                stats.chainbreaks += 1
+                break
+            stats.blocks += 1
+            if remain > num and nextblockid != blockid + 1:
+                stats.chainjumps += 1
+            yield blockid, buf[pos + 4:pos + 4 + num * datasize]
+            remain -= num
+            blockid = nextblockid
+
+    def _readchain(self, goodsid, blocks, remain=None):
+        """按已知的块号列表读取一只股票的数据块, 生成 (blockid, 块内数据) 元组.
+
+        物理上相邻的块合并为一次读取, 单次不超过DF_READAHEAD_SIZE.
+
+        :param goodsid: 股票id
+        :param blocks:  数据块号列表
+        :param remain:  blocks中的记录总数, 缺省为该股票的datanum
+        """
+        blocksize = self.blocksize
+        blockdatanum = self.blockdatanum
+        datasize = self.datasize
+        maxrun = max(1, DF_READAHEAD_SIZE // blocksize)
+        if remain is None:
+            remain = self.head.dfgs[self.goodsidx[goodsid]].datanum
+        stats = self._counter()
+        i = 0
+        while i < len(blocks) and remain > 0:
+            if i and blocks[i] != blocks[i - 1] + 1:
+                stats.chainjumps += 1
+            j = i + 1
+            while (j < len(blocks) and j - i < maxrun
+                   and blocks[j] == blocks[j - 1] + 1):
+                j += 1
+            nblocks = min(j - i, (remain - 1) // blockdatanum + 1)
+            lastnum = min(remain - (nblocks - 1) * blockdatanum, blockdatanum)
+            size = (nblocks - 1) * blocksize + 4 + lastnum * datasize
+            buf = memoryview(self.readat(size, blocks[i] * blocksize))
+            stats.blocks += nblocks
+            for k in range(nblocks):
+                pos = k * blocksize
+                num = min(remain, blockdatanum)
+                yield blocks[i + k], buf[pos + 4:pos + 4 + num * datasize]
+                remain -= num
+            i += nblocks
+        if remain > 0:
+            # 索引或块号列表短于datanum所需的块数
+            stats.chainbreaks += 1
+
+    def _getgoodschain(self, goodsid):
+        """返回一只股票的数据块号列表
+
+        有效的索引项优先, 否则只读块头沿链表解析. 完整的解析结果按股票缓存,
+        datanum增长后从缓存的最后一块继续解析, 不必从blockfirst重新开始.
+        链表中断时返回的列表短于datanum所需的块数.
+
+        :param goodsid: 股票id
+        :returns: array('I') 数据块号列表
+        """
+        blocks = self._indexedchain(goodsid)
+        if blocks is not None:
+            return blocks
+        dfg = self.head.dfgs[self.goodsidx[goodsid]]
+        needed = (dfg.datanum - 1) // self.blockdatanum + 1 \
+            if dfg.datanum > 0 else 0
+        cached = self._chaincache.get(goodsid)
+        if cached is not None and cached[0] == dfg.blockfirst:
+            if len(cached[1]) >= needed:
+                return cached[1][:needed]
+        if cached is not None and cached[0] == dfg.blockfirst and cached[1]:
+            # 最后一块的下一块号可能已更新, 从它开始重新读块头
+            blocks = array('I', cached[1])
+            blockid = blocks.pop()
+        else:
+            blocks = array('I')
+            blockid = dfg.blockfirst
+        while len(blocks) < needed:
+            data = self.readat(4, blockid * self.blocksize)
+            if len(data) < 4:
+                self._counter().chainbreaks += 1
+                break
+            nextblockid, = struct.unpack('I', data)
+            if nextblockid > dfg.blocklast:
+                self._counter().chainbreaks += 1
+                break
+            blocks.append(blockid)
+            blockid = nextblockid
+        if len(blocks) == needed:
+            # 链表中断时不缓存, 下次从blockfirst重新解析
+            self._chaincache[goodsid] = (dfg.blockfirst, blocks)
+        return blocks
+
+    def _indexedchain(self, goodsid):
+        """返回索引中有效的块号列表, 无索引项或已失效时返回None"""
+        entry = self.blockindex.get(goodsid)
+        if entry is None:
+            return None
+        datanum, blocklast, blocks = entry
+        dfg = self.head.dfgs[self.goodsidx[goodsid]]
+        if datanum != dfg.datanum or blocklast != dfg.blocklast:
+            return None
+        return blocks
+
+    def _indexstamp(self):
+        st = os.fstat(self._f)
+        return (INDEX_MAGIC, st.st_mtime, st.st_size, self.head.info.blocksuse,
+                self.blocksize, self.datasize)
+
+    def buildindex(self, filename=None):
+        """解析所有股票的数据块链表, 写入旁路索引文件并启用
+
+        :param filename: 索引文件名, 缺省为 self.filename + INDEX_SUFFIX
+        """
+        if filename is None:
+            filename = self.filename + INDEX_SUFFIX
+        index = {}
+        for goodsid in self.goodsidx:
+            dfg = self.head.dfgs[self.goodsidx[goodsid]]
+            index[goodsid] = (dfg.datanum, dfg.blocklast,
+                              self._getgoodschain(goodsid))
+        chunks = [struct.pack('=8sdQ4I', *(self._indexstamp() + (len(index),)))]
+        for goodsid, (datanum, blocklast, blocks) in index.items():
+            chunks.append(struct.pack('=4I', goodsid, datanum, blocklast,
+                                      len(blocks)))
+            chunks.append(blocks.tobytes())
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'wb') as f:
+            f.write(b''.join(chunks))
+        os.replace(tmpname, filename)
+        self.blockindex = index
+
+    def loadindex(self, filename=None):
+        """加载旁路索引文件, 文件不存在或已失效时不启用
+
+        :param filename: 索引文件名, 缺省为 self.filename + INDEX_SUFFIX
+        :returns: 是否成功加载
+        """
+        if filename is None:
+            filename = self.filename + INDEX_SUFFIX
+        self.blockindex = {}
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except EnvironmentError:
+            return False
+        headsize = struct.calcsize('=8sdQ4I')
+        if len(data) < headsize:
+            return False
+        stamp = struct.unpack_from('=8sdQ4I', data, 0)
+        if stamp[:-1] != self._indexstamp():
+            return False
+        index = {}
+        offset = headsize
+        for i in range(stamp[-1]):
+            goodsid, datanum, blocklast, nblocks = struct.unpack_from(
+                '=4I', data, offset)
+            offset += 16
+            blocks = array('I', data[offset:offset + nblocks * 4])
+            offset += nblocks * 4
+            index[goodsid] = (datanum, blocklast, blocks)
+        self.blockindex = index
+        return True
+
     def _getgoodsraw(self, goodsid):
         """读取并连接一只股票的原始数据块.
 
         :param goodsid: 股票id
         :returns: 拼接好的连续原始数据
         """
-        try:
-            index = self.goodsidx[goodsid]
-            datanum = self.head.dfgs[index].datanum
-            blockid = self.head.dfgs[index].blockfirst
-            readtime = (datanum - 1) // self.blockdatanum + 1
-            for i in range(readtime):
-                offset = blockid * self.blocksize
-                if offset > self._filesize:
-                    break
-                nextblockid, = struct.unpack('I', self.readat(4, offset))
-                if nextblockid > self.head.dfgs[index].blocklast:
-                    break
-                if i == readtime - 1:
-                    length = (datanum %
-                              self.blockdatanum) * self.datasize
-                else:
-                    length = self.blockdatanum * self.datasize
-                blockid = nextblockid
-                offset += 4
-                block = self.readat(length, offset)
-                yield block
-        except Exception as e:
-            traceback.print_exc()
-            sys.exit(1)
+        blocks = self._indexedchain(goodsid)
+        if blocks is None:
+            chain = self._walkchain(goodsid)
+        else:
+            chain = self._readchain(goodsid, blocks)
+        for blockid, block in chain:
+            yield block
 
-    def getgoodstms(self, goodsid):
+    def getgoodstms(self, goodsid, start=None, end=None):
         """返回指定goodsid的股票时序数据
 
+        指定start或end时只返回时间落在闭区间[start, end]内的记录. 时间按数据类
+        的timekey比较, Bargain为(date, time), 其他为time; 边界可以只给出前缀,
+        如Bargain的 start=20171017 表示从该日开始, end=(20171017, 93000)
+        表示到该日9:30:00为止. 链表中的记录按时间有序, 先对数据块首条记录
+        二分查找起始块, 超过end即停止读取.
+
         :param goodsid: 股票id
+        :param start:   起始时间, 缺省不限
+        :param end:     结束时间, 缺省不限
         :returns: 指定股票的时序数据的生成器
         """
-        blocks = self._getgoodsraw(goodsid)
-        cls = self.datacls
+        if self.cache is not None and goodsid in self.goodsidx:
+            records = self._getcached(goodsid, start, end)
+        else:
+            records = self._getgoodstms(goodsid, start, end)
+        if self.statshook is None:
+            return records
+        return self._measureiter('getgoodstms', records)
+
+    def _cachekey(self, goodsid):
+        dfg = self.head.dfgs[self.goodsidx[goodsid]]
+        return ((self._fileid, self.datacls, goodsid),
+                (dfg.datanum, dfg.blocklast, dfg.blockfirst, dfg.datalastidx))
+
+    def _getcached(self, goodsid, start, end):
+        """经缓存读取, 见getgoodstms; 只读部分数据且未缓存时不放入缓存"""
+        key, stamp = self._cachekey(goodsid)
+        records = self.cache.get(key, stamp)
+        if records is None:
+            if start is not None or end is not None:
+                return self._getgoodstms(goodsid, start, end)
+            records = list(self._getgoodstms(goodsid, None, None))
+            self.cache.put(key, stamp, records)
+            return iter(records)
+        result = iter(records)
+        if start is not None:
+            getstart, start = self._attrgetter(start)
+            result = dropwhile(lambda r: getstart(r) < start, result)
+        if end is not None:
+            getend, end = self._attrgetter(end)
+            result = takewhile(lambda r: not getend(r) > end, result)
+        return result
+
+    def _attrgetter(self, bound):
+        """同_keygetter, 从记录对象按属性取时间键"""
+        if not isinstance(bound, tuple):
+            bound = (bound,)
+        names = self.datacls.timekey[:len(bound)]
+        if len(names) == 1:
+            return attrgetter(names[0]), bound[0]
+        return attrgetter(*names), bound
+
+    def _getgoodstms(self, goodsid, start, end):
+        if start is None and end is None:
+            batches = self._iterbatches(self._getgoodsraw(goodsid))
+        else:
+            batches = self._getrangebatches(goodsid, start, end)
+        # 分段构造, 同时存活的记录对象少于gc第0代阈值, 不触发额外的gc
+        for batch in batches:
+            for i in range(0, len(batch), 128):
+                for record in self._records(batch[i:i + 128]):
+                    yield record
+
+    def _itertuples(self, blocks):
+        """将数据块逐条解包为元组, 见_iterbatches"""
+        for batch in self._iterbatches(blocks):
+            for t in batch:
+                yield t
+
+    def _iterbatches(self, blocks):
+        """将数据块解包为记录元组, 每块生成一个list, 跨块的记录与上一块剩余部分拼接"""
+        st = self.datacls.struct
         step = self.datasize
-        head = 0
+        stats = self._counter()
         buf = b''
         for block in blocks:
-            blocklen = len(block)
-            buflen = len(buf)
-            if step > buflen > 0:
-                head = step - buflen
-                point = self._datacls()
-                point.read(buf + block[:head])
-                yield point
-            buf = b''
-            for start in range(head, blocklen, step):
-                end = start + step
-                if end <= blocklen:
-                    point = cls()
-                    point.read(block[start:end])
-                    yield point
+            begin = time.perf_counter()
+            block = memoryview(block)
+            start = 0
+            tuples = []
+            if buf:
+                start = step - len(buf)
+                if start > len(block):
+                    buf = bytes(buf) + block.tobytes()
+                    continue
+                tuples.append(st.unpack(bytes(buf) + block[:start].tobytes()))
+            end = start + (len(block) - start) // step * step
+            tuples.extend(st.iter_unpack(block[start:end]))
+            buf = block[end:]
+            stats.records += len(tuples)
+            stats.decodetime += time.perf_counter() - begin
+            yield tuples
+
+    def _keygetter(self, bound):
+        """返回 (从记录元组取时间键的函数, 规整后的边界值), 边界可为timekey前缀"""
+        if not isinstance(bound, tuple):
+            bound = (bound,)
+        idx = self.datacls.timekeyidx[:len(bound)]
+        if len(idx) == 1:
+            return itemgetter(idx[0]), bound[0]
+        return itemgetter(*idx), bound
+
+    def _firstkey(self, blockid, getkey):
+        """读取数据块中首条记录的时间键"""
+        data = self.readat(self.datasize, blockid * self.blocksize + 4)
+        return getkey(self.datacls.struct.unpack(data))
+
+    def _getrangebatches(self, goodsid, start, end):
+        """按时间范围读取记录元组, 每块生成一个list, 见getgoodstms"""
+        blocks = self._getgoodschain(goodsid)
+        first = 0
+        if start is not None:
+            getstart, start = self._keygetter(start)
+            # 找到首条记录不小于start的第一块, 与start相等的记录可能在其前一块
+            lo, hi = 0, len(blocks)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._firstkey(blocks[mid], getstart) < start:
+                    lo = mid + 1
                 else:
-                    buf = block[start:]
+                    hi = mid
+            first = max(lo - 1, 0)
+        if end is not None:
+            getend, end = self._keygetter(end)
+        remain = self.head.dfgs[self.goodsidx[goodsid]].datanum - \
+            first * self.blockdatanum
+        chain = self._readchain(goodsid, blocks[first:], remain)
+        for batch in self._iterbatches(block for blockid, block in chain):
+            if start is not None:
+                batch = [t for t in batch if not getstart(t) < start]
+            if end is not None:
+                kept = list(takewhile(lambda t: not getend(t) > end, batch))
+                if len(kept) < len(batch):
+                    yield kept
+                    return
+            yield batch
+
+    def tail(self, goodsid, n=1):
+        """返回指定股票最新的n条数据
+
+        只需最后一块时直接读取blockdata指向的最后一个数据块; 否则借助索引或
+        缓存的块号列表(见_getgoodschain)只读取最后几块, 不从头解码整个序列.
+
+        :param goodsid: 股票id
+        :param n:       条数
+        :returns: 按时间顺序排列的最新n条数据的list
+        """
+        datanum = self.head.dfgs[self.goodsidx[goodsid]].datanum
+        with self._measure('tail'):
+            if self.cache is not None:
+                records = self.cache.get(*self._cachekey(goodsid))
+                if records is not None:
+                    return records[max(datanum - n, 0):]
+            return self._getfrom(goodsid, max(datanum - n, 0))
+
+    def _getfrom(self, goodsid, first):
+        """返回指定股票第first条(从0开始)及以后的数据list, 见tail"""
+        dfg = self.head.dfgs[self.goodsidx[goodsid]]
+        datanum = dfg.datanum
+        if first >= datanum:
+            return []
+        lastnum = (datanum - 1) % self.blockdatanum + 1
+        if datanum - first <= lastnum and \
+                self._indexedchain(goodsid) is None and \
+                goodsid not in self._chaincache:
+            data = self.readat(4 + lastnum * self.datasize,
+                               dfg.blockdata * self.blocksize)
+            self._counter().blocks += 1
+            skip = first - (datanum - lastnum)
+            return self._records(list(
+                islice(self._itertuples([memoryview(data)[4:]]), skip, None)))
+        blocks = self._getgoodschain(goodsid)
+        start = first // self.blockdatanum
+        chain = self._readchain(goodsid, blocks[start:],
+                                datanum - start * self.blockdatanum)
+        tuples = self._itertuples(block for blockid, block in chain)
+        skip = first - start * self.blockdatanum
+        return self._records(list(islice(tuples, skip, None)))
+
+    def refresh(self):
+        """重新读取文件头部, 用于读取其他进程仍在写入的数据文件
+
+        文件变大时mmap模式重新映射
+        """
+        self._readhead()
+        self._filesize = os.fstat(self._f).st_size
+        if self._mm is not None and len(self._mm) != self._filesize:
+            self._munmap()
+            self._mmap()
+
+    def poll(self, checkpoint):
+        """重新读取头部, 返回checkpoint以来新增的数据
+
+        只读取datanum增长的股票新增的记录. datanum变小说明该股票数据被重写,
+        此时从头读取. checkpoint中没有的股票视为从0开始.
+
+        :param checkpoint: goodsid => 已读取的datanum 字典, 原地更新
+        :returns: (goodsid, 新增数据list) 元组的list
+        """
+        with self._measure('poll'):
+            self.refresh()
+            datanums = self.head.dfgs.column(1)
+            result = []
+            for goodsid, index in self.goodsidx.items():
+                datanum = datanums[index]
+                old = checkpoint.get(goodsid, 0)
+                if datanum == old:
+                    continue
+                if datanum < old:
+                    old = 0
+                records = self._getfrom(goodsid, old)
+                if records:
+                    result.append((goodsid, records))
+                checkpoint[goodsid] = datanum
+            return result
+
+    def follow(self, checkpoint=None, interval=1.0):
+        """持续跟踪正在写入的数据文件, 生成新增数据的 (goodsid, 数据list) 元组
+
+        每隔interval秒调用一次poll, 只读头部和新增的记录, 不重新解析整个序列.
+
+        :param checkpoint: goodsid => 已读取的datanum 字典, 原地更新, 可保存
+                           后下次继续; 缺省从当前位置开始, 只返回之后新增的数据
+        :param interval:   轮询间隔秒数
+        :returns: 生成器; 缺省的checkpoint在调用时即取得, 不等到第一次next
+        """
+        if checkpoint is None:
+            self.refresh()
+            datanums = self.head.dfgs.column(1)
+            checkpoint = dict((goodsid, datanums[index])
+                              for goodsid, index in self.goodsidx.items())
+        return self._follow(checkpoint, interval)
+
+    def _follow(self, checkpoint, interval):
+        while True:
+            for item in self.poll(checkpoint):
+                yield item
+            time.sleep(interval)
+
+    def getgoodsarray(self, goodsid, raw=False):
+        """返回指定goodsid的股票时序数据, 整体解析为numpy结构化数组
+
+        :param goodsid: 股票id
+        :param raw:     是否保留XInt32原始值, 见datatype.npdtype
+        :returns: numpy结构化数组, 字段名同数据类的layout
+        """
+        with self._measure('getgoodsarray'):
+            return self._nparray(b''.join(self._getgoodsraw(goodsid)), raw)
+
+    def _nparray(self, data, raw):
+        """nparray解析原始数据, 计入records和decodetime"""
+        stats = self._counter()
+        start = time.perf_counter()
+        result = nparray(self.datacls, data, raw)
+        stats.decodetime += time.perf_counter() - start
+        stats.records += len(result)
+        return result
+
+    def getfilearray(self, goodsids=None, raw=False, processes=None):
+        """返回整个文件(或指定若干股票)的时序数据, 拼接为一个numpy结构化数组
+
+        第i只股票的数据为 data[offsets[i]:offsets[i + 1]]
+
+        :param goodsids:  股票id列表, 缺省为文件中所有股票
+        :param raw:       是否保留XInt32原始值, 见datatype.npdtype
+        :param processes: 大于1时按股票分片, 由进程池各自重新打开文件解析后合并
+        :returns: (goodsids, offsets, data) 元组
+        """
+        if goodsids is None:
+            goodsids = list(self.goodsidx)
+        with self._measure('getfilearray'):
+            return self._getfilearray(goodsids, raw, processes)
+
+    def _getfilearray(self, goodsids, raw, processes):
+        if processes and processes > 1 and goodsids:
+            results = self._mapshards(goodsids, raw, None, processes)
+            ids, offsets, data = zip(*results)
+            starts = np.cumsum([0] + [len(d) for d in data[:-1]])
+            offsets = np.concatenate(
+                [o[:-1] + start for o, start in zip(offsets, starts)] +
+                [np.array([sum(len(d) for d in data)], dtype=np.int64)])
+            return np.concatenate(ids), offsets, np.concatenate(data)
+        chunks = []
+        counts = []
+        for goodsid in goodsids:
+            blocks = list(self._getgoodsraw(goodsid))
+            chunks.extend(blocks)
+            counts.append(sum(len(b) for b in blocks) // self.datasize)
+        data = self._nparray(b''.join(chunks), raw)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return np.array(goodsids, dtype=np.uint32), offsets, data
+
+    def export(self, path, fmt='npy', processes=None):
+        """把整个文件解析后导出为列式格式, 见export模块
+
+        :param path:      npy为输出目录, arrow, parquet为输出文件名
+        :param fmt:       'npy', 'arrow' 或 'parquet'
+        :param processes: 大于1时用进程池解析, 见getfilearray
+        :returns: 写出的文件名列表
+        """
+        exporters = {
+            'npy': exportnpy,
+            'arrow': exportarrow,
+            'parquet': exportparquet,
+        }
+        if fmt not in exporters:
+            raise ValueError('unknown export format: {0}'.format(fmt))
+        goodsids, offsets, data = self.getfilearray(processes=processes)
+        return exporters[fmt](goodsids, offsets, data, path)
+
+    def saveshards(self, prefix, goodsids=None, raw=False, processes=None):
+        """按股票分片, 由进程池各自解析并写出 prefix.<k>.npz 文件
+
+        每个文件包含 goodsids, offsets, data 三个数组, 含义同getfilearray
+
+        :param prefix:    输出文件名前缀
+        :param goodsids:  股票id列表, 缺省为文件中所有股票
+        :param raw:       是否保留XInt32原始值, 见datatype.npdtype
+        :param processes: 进程数, 缺省为CPU数
+        :returns: 写出的文件名列表
+        """
+        if goodsids is None:
+            goodsids = list(self.goodsidx)
+        return list(self._mapshards(goodsids, raw, prefix,
+                                    processes or os.cpu_count()))
+
+    def _splitshards(self, goodsids, nshards):
+        """把goodsids按顺序切成nshards段, 各段记录数大致相等"""
+        counts = self.head.dfgs.column(1)
+        weights = [counts[self.goodsidx[g]] + 1 for g in goodsids]
+        total = sum(weights)
+        shards = []
+        start = acc = 0
+        for i, w in enumerate(weights):
+            acc += w
+            if acc * nshards >= total * (len(shards) + 1):
+                shards.append(goodsids[start:i + 1])
+                start = i + 1
+        if start < len(goodsids):
+            shards.append(goodsids[start:])
+        return shards
+
+    def _mapshards(self, goodsids, raw, prefix, processes):
+        """在进程池中解析各分片, 按分片顺序返回结果"""
+        shards = self._splitshards(list(goodsids), processes * 4)
+        tasks = [
+            (self.filename, self.datacls, shard, raw,
+             None if prefix is None else '{0}.{1}.npz'.format(prefix, k),
+             self._openargs)
+            for k, shard in enumerate(shards)
+        ]
+        with ProcessPoolExecutor(processes) as pool:
+            return list(pool.map(_shardarray, tasks))
 
     def __getitem__(self, gid):
-        """重载下标运算符[], 返回一个指定股票的所有数据的list而不是生成器"""
+        """重载下标运算符[], 返回一个指定股票的所有数据的list而不是生成器
+
+        df[gid, start:end] 返回时间范围内的数据, 与getgoodstms(gid, start, end)
+        相同, 是包含end的闭区间
+        """
+        if isinstance(gid, tuple):
+            gid, rng = gid
+            return list(self.getgoodstms(gid, rng.start, rng.stop))
         return [t for t in self.getgoodstms(gid)]
 
-    def addblock(self):
-        if self.head.info.blocksuse >= self.head.info.blockstotal:
-            n = self.head.info.blockstotal + DF_BLOCK_GROWBY
-            offset = n * DF2_BLOCK_SIZE
-            os.ftruncate(self._f, offset)
-            os.head.info.blockstotal = n
-        os.head.info.blocksuse += 1
-        return os.head.info.blocksuse
+    def addblock(self, n=1):
+        """分配n个连续的新数据块, 文件按DF_BLOCK_GROWBY块的整数倍增长
+
+        :param n: 块数
+        :returns: 第一个新块的块号
+        """
+        info = self.head.info
+        first = info.blocksuse
+        if first + n > info.blockstotal:
+            grow = first + n - info.blockstotal
+            total = info.blockstotal + \
+                (grow - 1) // DF_BLOCK_GROWBY * DF_BLOCK_GROWBY + DF_BLOCK_GROWBY
+            os.ftruncate(self._f, total * self.blocksize)
+            info.blockstotal = total
+            self._filesize = total * self.blocksize
+        info.blocksuse = first + n
+        return first
+
+    def compact(self, filename):
+        """整理碎片, 写出一个每只股票数据块物理连续且有序的新文件
+
+        股票顺序, code, datalastidx 与原文件相同; 未使用的块和goodsid为0的
+        空位被回收, blockfirst, blocklast, blocksuse 等按新布局重新计算.
 
-    def setgoodstms(gid, tms):
-        pass
+        某只股票的链表读出的记录少于datanum(链表断开或文件被截断)时抛出
+        ValueError, 不留下新文件.
+
+        :param filename: 新文件名, 不能与原文件相同
+        """
+        if os.path.abspath(filename) == os.path.abspath(self.filename):
+            raise ValueError('cannot compact a data file onto itself')
+        try:
+            with DataFileBuilder(filename, self.datacls,
+                                 self.version) as builder:
+                builder.head.info.reserved = self.head.info.reserved
+                for goodsid, index in self.goodsidx.items():
+                    dfg = self.head.dfgs[index]
+                    data = b''.join(self._getgoodsraw(goodsid))
+                    if len(data) != dfg.datanum * self.datasize:
+                        raise ValueError(
+                            'broken block chain of goods {0}: {1} of {2} '
+                            'records'.format(goodsid, len(data) // self.datasize,
+                                             dfg.datanum))
+                    builder.add(goodsid, data, dfg.code)
+                    newdfg = builder.head.dfgs[builder.head.info.goodsnum - 1]
+                    newdfg.datalastidx = dfg.datalastidx
+        except Exception:
+            if os.path.exists(filename):
+                os.remove(filename)
+            raise
+
+    def _writechain(self, blocks, data, nextblockid=0):
+        """把连续的原始记录数据按块写入blocks, 并写好各块的下一块号
+
+        物理相邻的块拼接为一次写入, 见packblocks
+
+        :param blocks:      块号列表
+        :param data:        原始记录数据
+        :param nextblockid: 最后一块的下一块号
+        """
+        bodysize = self.blockdatanum * self.datasize
+        for blockid, buf in packblocks(blocks, data, self.blocksize, bodysize,
+                                       nextblockid):
+            self.writeat(buf, blockid * self.blocksize)
+
+    def _packtms(self, tms):
+        """把时序数据打包为连续的原始记录数据, 见packrecords"""
+        return packrecords(self.datacls, tms)
+
+    def _newgoods(self, gid):
+        """在头部分配一个新的DataFileGoods, 返回其下标"""
+        info = self.head.info
+        index = info.goodsnum
+        if index >= DF_MAX_GOODSUM:
+            raise ValueError('goods number exceeds {0}'.format(DF_MAX_GOODSUM))
+        info.goodsnum += 1
+        dfg = self.head.dfgs[index]
+        dfg.goodsid = gid
+        dfg.datanum = dfg.blockfirst = dfg.blockdata = dfg.blocklast = 0
+        dfg.datalastidx = 0
+        self.goodsidx[gid] = index
+        return index
+
+    def _flushgoods(self, gid, blocks, datanum, data):
+        """写入后更新一只股票的DataFileGoods, 并把头部信息和该项写回文件
+
+        :param blocks:  新的数据块号列表
+        :param datanum: 新的记录数
+        :param data:    最后写入的原始记录数据, 用于取最后一条记录的时间
+        """
+        index = self.goodsidx[gid]
+        dfg = self.head.dfgs[index]
+        dfg.datanum = datanum
+        if blocks:
+            dfg.blockfirst = blocks[0]
+            dfg.blockdata = blocks[-1]
+            dfg.blocklast = max(dfg.blocklast, blocks[-1])
+        if len(data) >= self.datasize:
+            last = self.datacls.struct.unpack(data[-self.datasize:])
+            dfg.datalastidx = last[self.datacls.timekeyidx[0]]
+        self._chaincache[gid] = (dfg.blockfirst, array('I', blocks))
+        self.blockindex.pop(gid, None)
+        if self.cache is not None:
+            self.cache.discard(self._cachekey(gid)[0])
+        self.writeat(self.head.info.pack(), 0)
+        self.writeat(dfg.pack(),
+                     SIZEOF_DATA_FILE_INFO + index * SIZEOF_DATA_FILE_GOODS)
+        if self._mm is not None and len(self._mm) != self._filesize:
+            self._munmap()
+            self._mmap()
+
+    def _fullchain(self, gid):
+        """返回一只股票完整的数据块号list, 链表中断时抛出ValueError
+
+        写入前检查, 避免从链表中间的块开始覆盖有效数据
+        """
+        dfg = self.head.dfgs[self.goodsidx[gid]]
+        blocks = list(self._getgoodschain(gid))
+        needed = (dfg.datanum - 1) // self.blockdatanum + 1 \
+            if dfg.datanum > 0 else 0
+        if len(blocks) != needed:
+            raise ValueError('broken block chain of goods {0}: {1} of {2} '
+                             'blocks'.format(gid, len(blocks), needed))
+        return blocks
+
+    def _spareblocks(self, gid, blocks):
+        """数据块链表最后一块指向的预分配空块(blocklast), 没有时返回空list"""
+        dfg = self.head.dfgs[self.goodsidx[gid]]
+        if not blocks:
+            return []
+        nextblockid, = struct.unpack(
+            'I', self.readat(4, blocks[-1] * self.blocksize))
+        if nextblockid == dfg.blocklast and nextblockid not in blocks:
+            return [nextblockid]
+        return []
+
+    def setgoodstms(self, gid, tms):
+        """写入一只股票的全部时序数据, 替换原有数据
+
+        原有的数据块按链表顺序复用, 不够时一次分配所需的全部新块; 数据按
+        物理相邻的块合并为少数几次大的写入, 头部只在最后写回一次.
+        原有的链表中断时抛出ValueError, 不写入任何数据.
+
+        :param gid: 股票id
+        :param tms: 数据对象序列, 如Day对象的list
+        """
+        data = self._packtms(tms)
+        datanum = len(data) // self.datasize
+        with self.thlk:
+            if gid in self.goodsidx:
+                blocks = self._fullchain(gid)
+                blocks += self._spareblocks(gid, blocks)
+            else:
+                self._newgoods(gid)
+                blocks = []
+            needed = (datanum - 1) // self.blockdatanum + 1 if datanum else 0
+            if needed > len(blocks):
+                first = self.addblock(needed - len(blocks))
+                blocks.extend(range(first, first + needed - len(blocks)))
+            blocks = blocks[:needed]
+            self._writechain(blocks, data)
+            self._flushgoods(gid, blocks, datanum, data)
 
     def __setitem__(self, gid, tms):
         self.setgoodstms(gid, tms)
 
     def appendgoodstms(self, gid, tms):
-        pass
+        """在一只股票的时序数据末尾追加数据
+
+        先填满最后一个数据块的剩余空间, 其余数据一次分配所需的新块后按块
+        写入; 最后一块指向的预分配空块(blocklast)会被优先使用.
+        链表中断时抛出ValueError, 不写入任何数据.
+
+        :param gid: 股票id
+        :param tms: 数据对象序列, 或原始记录数据, 见packrecords
+        """
+        data = self._packtms(tms)
+        with self.thlk:
+            if gid not in self.goodsidx or \
+                    self.head.dfgs[self.goodsidx[gid]].datanum == 0:
+                # tms可能是生成器, 已在打包时取完
+                self.setgoodstms(gid, data)
+                return
+            dfg = self.head.dfgs[self.goodsidx[gid]]
+            blocks = self._fullchain(gid)
+            datanum = dfg.datanum
+            lastblock = blocks[-1]
+            # 最后一块的剩余空间
+            used = (datanum - 1) % self.blockdatanum + 1
+            room = (self.blockdatanum - used) * self.datasize
+            head, rest = data[:room], data[room:]
+            if head:
+                self.writeat(head, lastblock * self.blocksize + 4 +
+                             used * self.datasize)
+            newblocks = []
+            if rest:
+                needed = (len(rest) // self.datasize - 1) // self.blockdatanum + 1
+                newblocks = self._spareblocks(gid, blocks)
+                if needed > len(newblocks):
+                    first = self.addblock(needed - len(newblocks))
+                    newblocks.extend(range(first,
+                                           first + needed - len(newblocks)))
+                self._writechain(newblocks, rest)
+                self.writeat(struct.pack('I', newblocks[0]),
+                             lastblock * self.blocksize)
+            self._flushgoods(gid, blocks + newblocks,
+                             datanum + len(data) // self.datasize, data)
 
     def _readhead(self):
         """读文件头部, 并生成一个 goodsid => index 字典 goodsidx"""
+        start = time.perf_counter()
         try:
-            data = self.readat(SIZEOF_DATA_FILE_HEAD, 0)
+            data = bytes(self.readat(SIZEOF_DATA_FILE_HEAD, 0))
         except Exception as e:
             traceback.print_exc()
             sys.exit(1)
 
         self.head.read(data)
-        for index in range(min(self.head.info.goodsnum, DF_MAX_GOODSUM)):
-            """
-            goodsnum 有可能比实际股票数多,
-            但实际不会超出DF_MAX_GOODSUM, 这是DS Day.dat 已经显现的一个bug
-            """
-            goodsid = self.head.dfgs[index].goodsid
-            if goodsid > 0:
-                self.goodsidx[goodsid] = index
+        """
+        goodsnum 有可能比实际股票数多,
+        但实际不会超出DF_MAX_GOODSUM, 这是DS Day.dat 已经显现的一个bug
+        """
+        goodsnum = min(self.head.info.goodsnum, DF_MAX_GOODSUM)
+        goodsids = self.head.dfgs.column(0)[:goodsnum]
+        self.goodsidx = dict(
+            (goodsid, index) for index, goodsid in enumerate(goodsids)
+            if goodsid > 0
+        )
+        self._counter().headtime += time.perf_counter() - start
 
     def _writehead(self):
         self.writeat(self.head.pack(), 0)
@@ -344,3 +1421,119 @@ class DataFile:
         """len函数可获取DataFile对象中股票数量"""
         return len(self.goodsidx)
 
+
+
+class DataFileBuilder:
+    """顺序写出一个完整的新数据文件
+
+    每只股票的数据块连续存放, 数据按大块顺序写入, 头部只在close时写一次.
+    已存在的同名文件会被覆盖.
+
+    usage:
+
+        >>> with DataFileBuilder('Day.dat', Day) as builder:
+                builder.add(1, days)
+                builder.add(2, array)   # getgoodsarray(raw=True)的结果
+
+        >>> DataFileBuilder('Day.dat', Day).build({1: days, 2: array})
+    """
+    def __init__(self, filename, datacls, version=1):
+        """
+        :param filename: 文件名
+        :param datacls:  数据类
+        :param version:  1: EM_DataFile, 2: EM_DataFile2
+        """
+        self.filename = filename
+        self.datacls = datacls
+        self.thlk = threading.RLock()
+        self.head = DataFileHead(version)
+        self.blocksize = DF2_BLOCK_SIZE if version == 2 else DF_BLOCK_SIZE
+        self.datasize = datacls.getsize()
+        self.blockdatanum = (self.blocksize - 4) // self.datasize
+        self.head.info.version = version
+        self._nextblock = SIZEOF_DATA_FILE_HEAD // self.blocksize
+        self._reserved = None
+        flag = os.O_RDWR | os.O_CREAT | os.O_TRUNC
+        if _IS_WINDOWS:
+            flag |= os.O_BINARY
+        self._f = os.open(filename, flag, 0o666)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _blocksneeded(self, datanum):
+        return (datanum - 1) // self.blockdatanum + 1 if datanum else 0
+
+    def reserve(self, datanums):
+        """按各只股票的记录数预先把文件扩展到最终大小, 只调用一次ftruncate
+
+        :param datanums: 各只股票记录数的序列
+        """
+        total = self._nextblock + sum(self._blocksneeded(n) for n in datanums)
+        os.ftruncate(self._f, total * self.blocksize)
+        self._reserved = total
+
+    def add(self, goodsid, tms, code=None):
+        """追加一只股票, 其数据块紧接上一只股票连续存放
+
+        :param goodsid: 股票id
+        :param tms:     时序数据, 见packrecords
+        :param code:    DataFileGoods中的code字段
+        """
+        info = self.head.info
+        if info.goodsnum >= DF_MAX_GOODSUM:
+            raise ValueError('goods number exceeds {0}'.format(DF_MAX_GOODSUM))
+        data = packrecords(self.datacls, tms)
+        datanum = len(data) // self.datasize
+        nblocks = self._blocksneeded(datanum)
+        first = self._nextblock
+        blocks = range(first, first + nblocks)
+        bodysize = self.blockdatanum * self.datasize
+        for blockid, buf in packblocks(blocks, data, self.blocksize, bodysize):
+            safewrite(self.thlk, self._f, buf, blockid * self.blocksize)
+        self._nextblock += nblocks
+
+        dfg = self.head.dfgs[info.goodsnum]
+        info.goodsnum += 1
+        dfg.goodsid = goodsid
+        dfg.datanum = datanum
+        if nblocks:
+            dfg.blockfirst = first
+            dfg.blockdata = dfg.blocklast = first + nblocks - 1
+        if datanum:
+            last = self.datacls.struct.unpack(data[-self.datasize:])
+            dfg.datalastidx = last[self.datacls.timekeyidx[0]]
+        if code is not None:
+            dfg.code = code
+
+    def build(self, goods):
+        """写出全部股票并关闭文件
+
+        :param goods: goodsid => 时序数据 的字典或 (goodsid, 时序数据) 序列;
+                      时序数据都有长度时先用reserve一次扩展到最终大小
+        """
+        items = list(goods.items()) if hasattr(goods, 'items') else list(goods)
+        if all(hasattr(tms, '__len__') for goodsid, tms in items):
+            rawtypes = (bytes, bytearray, memoryview)
+            self.reserve([
+                len(tms) // self.datasize if isinstance(tms, rawtypes)
+                else len(tms) for goodsid, tms in items
+            ])
+        for goodsid, tms in items:
+            self.add(goodsid, tms)
+        self.close()
+
+    def close(self):
+        """写入头部, 文件大小规整为块大小的整数倍后关闭"""
+        if self._f is None:
+            return
+        info = self.head.info
+        info.blockstotal = info.blocksuse = self._nextblock
+        if self._reserved != self._nextblock:
+            os.ftruncate(self._f, self._nextblock * self.blocksize)
+        safewrite(self.thlk, self._f, self.head.pack(), 0)
+        os.close(self._f)
+        self._f = None
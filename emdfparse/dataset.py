@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import re
+import glob
+import heapq
+from itertools import repeat, chain
+from operator import attrgetter
+from .datafile import DataFile, DataFileStats
+
+
+def _naturalkey(filename):
+    """文件名中的数字按数值比较, HisMin.dat_2 排在 HisMin.dat_10 之前"""
+    return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', filename)]
+
+
+def expandpattern(pattern):
+    """展开通配符, 按文件名自然顺序排序"""
+    return sorted(glob.glob(pattern), key=_naturalkey)
+
+
+class DataSet:
+    """同一数据类型的一组数据文件, 如 Day.dat 与 Day_*.dat, HisMin.dat_1..n
+
+    各文件只打开一次, 股票索引合并: self.goodsidx 为 goodsid => 含该股票的
+    文件在self.files中的位置list. getgoodstms 对各文件的时序数据按timekey
+    逐条归并(heapq.merge), 不把整个序列读入内存. 某个时间在靠前的文件中
+    已有记录时, 之后文件中该时间的记录都去掉; 同一文件中时间相同的记录
+    (如同一秒内的多笔成交)都保留.
+
+    Bargain当日成交文件中date为0, 不同文件的 (date, time) 不能比较, 某个文件
+    的首条记录date为0时各文件的数据按文件顺序连接, 不归并也不去重.
+
+    usage:
+
+        >>> ds = DataSet('/usr/local/EMoney/Data/HisMin.dat_*', HisMin)
+        >>> for tm in ds.getgoodstms(1):
+                print(tm)
+        >>> ds[1, 1711130931:1711131500]
+    """
+    def __init__(self, filenames, datacls, **kwargs):
+        """
+        :param filenames: 文件名序列, 顺序即重复记录的优先顺序; 也可为通配符
+                          字符串, 按文件名自然顺序展开
+        :param datacls:   数据类
+        :param kwargs:    传给各DataFile的参数, 如usemmap, useindex, cache
+        """
+        if isinstance(filenames, str):
+            pattern = filenames
+            filenames = expandpattern(pattern)
+            if not filenames:
+                raise ValueError('no data file matches {0}'.format(pattern))
+        self.datacls = datacls
+        self.filenames = list(filenames)
+        self.files = [DataFile(filename, datacls, **kwargs)
+                      for filename in self.filenames]
+        self._mergeindex()
+        self._timekey = attrgetter(*datacls.timekey)
+        self._hasdate = datacls.timekey[0] == 'date'
+
+    def _mergeindex(self):
+        self.goodsidx = {}
+        for i, df in enumerate(self.files):
+            for goodsid in df.goodsidx:
+                self.goodsidx.setdefault(goodsid, []).append(i)
+
+    def __iter__(self):
+        return iter(self.goodsidx)
+
+    def __len__(self):
+        """合并后的股票数量"""
+        return len(self.goodsidx)
+
+    def __contains__(self, goodsid):
+        return goodsid in self.goodsidx
+
+    def items(self):
+        """同DataFile.items, value为归并后的时序数据生成器"""
+        return ((goodsid, self.getgoodstms(goodsid)) for goodsid in self)
+
+    def getgoodstms(self, goodsid, start=None, end=None):
+        """返回指定股票在各文件中时序数据的归并, 参数同DataFile.getgoodstms
+
+        :returns: 按时间有序, 去掉重复时间的生成器; 股票不存在时为空
+        """
+        files = [self.files[i] for i in self.goodsidx.get(goodsid, ())]
+        if len(files) == 1:
+            return files[0].getgoodstms(goodsid, start, end)
+        return self._merge([df.getgoodstms(goodsid, start, end)
+                            for df in files])
+
+    def _merge(self, streams):
+        """归并各文件的数据; 有date为0的文件时按文件顺序连接, 见DataSet"""
+        if self._hasdate:
+            peeked = []
+            nodate = False
+            for stream in streams:
+                stream = iter(stream)
+                first = next(stream, None)
+                if first is None:
+                    continue
+                nodate = nodate or first.date == 0
+                peeked.append(chain((first,), stream))
+            if nodate:
+                return chain.from_iterable(peeked)
+            streams = peeked
+        return self._heapmerge(streams)
+
+    def _heapmerge(self, streams):
+        """按timekey归并, heapq.merge对相等的键保持输入顺序, 即文件顺序
+
+        每条记录带上所在流的序号, 与上一条时间相同且来自不同的流时去掉
+        """
+        getkey = self._timekey
+        tagged = [zip(stream, repeat(i)) for i, stream in enumerate(streams)]
+        last = lastfile = None
+        for record, i in heapq.merge(*tagged, key=lambda t: getkey(t[0])):
+            key = getkey(record)
+            if key == last and i != lastfile:
+                continue
+            last, lastfile = key, i
+            yield record
+
+    def __getitem__(self, gid):
+        """同DataFile.__getitem__, 返回归并后的list"""
+        if isinstance(gid, tuple):
+            gid, rng = gid
+            return list(self.getgoodstms(gid, rng.start, rng.stop))
+        return list(self.getgoodstms(gid))
+
+    def tail(self, goodsid, n=1):
+        """返回指定股票归并后最新的n条数据, 每个文件只读取最后n条"""
+        files = [self.files[i] for i in self.goodsidx.get(goodsid, ())]
+        if len(files) == 1:
+            return files[0].tail(goodsid, n)
+        records = list(self._merge([df.tail(goodsid, n) for df in files]))
+        return records[max(len(records) - n, 0):]
+
+    def refresh(self):
+        """重新读取各文件头部, 重新合并股票索引"""
+        for df in self.files:
+            df.refresh()
+        self._mergeindex()
+
+    def stats(self, reset=False):
+        """各文件DataFile.stats的合计"""
+        total = DataFileStats()
+        for df in self.files:
+            total.add(df.stats(reset))
+        return total
@@ -5,8 +5,17 @@
 import os
 import sys
 import struct
-import ctypes
 import traceback
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# XInt32 指数 => 倍数, 16 ** e
+_XINT32_MUL = [16 ** e for e in range(8)]
 
 
 def xint32value(x):
@@ -16,34 +25,181 @@ def xint32value(x):
     :returns: 解析出来的实际值
 
     """
-    v = ctypes.c_uint32(x).value
-    # 低29位为基数
-    base = v & 0x1FFFFFFF
-    # 29位为基数符号位, 补码规则取其值
-    if base & 0x10000000:
-        base = ~base + 1
-        base &= 0x1FFFFFFF
-        base = -base
-    # 高三位为指数
-    return base * (16 ** (v >> 29))
+    # 低29位为基数, 29位为基数符号位, 异或再减做符号扩展; 高三位为指数
+    return (((x & 0x1FFFFFFF) ^ 0x10000000) - 0x10000000) * \
+        _XINT32_MUL[(x >> 29) & 7]
+
+
+def xint32values(values):
+    """批量解析XInt32, numpy数组走向量化计算, 其他序列查表逐个计算
+
+    :param values: 未解析前32位数据序列
+    :returns: 解析出来的实际值, numpy数组输入时返回int64数组, 否则返回list
+    """
+    if np is not None and isinstance(values, np.ndarray):
+        return xint32array(values)
+    mul = _XINT32_MUL
+    return [(((v & 0x1FFFFFFF) ^ 0x10000000) - 0x10000000) * mul[(v >> 29) & 7]
+            for v in values]
+
+
+def xint32array(a):
+    """xint32value的numpy向量化版本
+
+    :param a: 未解析前32位数据数组
+    :returns: 解析出来的实际值, int64数组
+    """
+    v = np.asarray(a).astype(np.uint32)
+    base = (v & 0x1FFFFFFF).astype(np.int64)
+    # 29位为基数符号位, 符号扩展
+    base -= (base & 0x10000000) << 1
+    # 高三位为指数, 16 ** e 即左移 4 * e 位
+    return base << ((v >> 29).astype(np.int64) * 4)
+
+
+def xint32encode(value):
+    """xint32value的逆运算, 相当于CPP代码中XInt32的赋值后GetRawData()
+
+    基数超出29位有符号范围时逐次除以16(向零取整)并增加指数, 精度随之降低
+
+    :param value: 实际值
+    :returns: 32位原始数据
+    """
+    exp = 0
+    while not -0x10000000 <= value < 0x10000000:
+        if exp == 7:
+            raise OverflowError('out of XInt32 range: {0}'.format(value))
+        value = value // 16 if value >= 0 else -(-value // 16)
+        exp += 1
+    return (exp << 29) | (value & 0x1FFFFFFF)
+
+
+def xint32encodearray(a):
+    """xint32encode的numpy向量化版本
+
+    :param a: 实际值数组
+    :returns: 32位原始数据, uint32数组
+    """
+    v = np.asarray(a).astype(np.int64)
+    exp = np.zeros(v.shape, dtype=np.int64)
+    for i in range(8):
+        big = (v >= 0x10000000) | (v < -0x10000000)
+        if not big.any():
+            break
+        if i == 7:
+            raise OverflowError('out of XInt32 range')
+        v = np.where(big, np.sign(v) * (np.abs(v) // 16), v)
+        exp += big
+    return ((exp << 29) | (v & 0x1FFFFFFF)).astype(np.uint32)
+
+
+# struct 格式字符 => numpy 类型
+_NPTYPES = {'I': 'u4', 'i': 'i4', 'H': 'u2', 'h': 'i2', 'B': 'u1', 'b': 'i1'}
+
+_npdtypes = {}
+
+
+def _fmtcodes(fmt):
+    """展开struct格式, 如 '=2Ib' => ['I', 'I', 'b']"""
+    codes = []
+    count = ''
+    for c in fmt.lstrip('=<>!@'):
+        if c.isdigit():
+            count += c
+        else:
+            codes.extend([c] * int(count or 1))
+            count = ''
+    return codes
+
+
+def npdtype(cls, raw=True):
+    """由数据类的fmt和layout生成numpy结构化数组类型
+
+    :param cls: 数据类, Day, Minute, Bargain, HisMin
+    :param raw: True 时与文件中的记录逐字节对应, False 时XInt32字段
+                (layout中下划线开头的字段)换成解析后的int64字段, 去掉下划线
+    :returns: numpy.dtype
+    """
+    key = (cls, raw)
+    if key in _npdtypes:
+        return _npdtypes[key]
+    codes = iter(_fmtcodes(cls.fmt))
+    fields = []
+    for name, count in cls.layout:
+        code = next(codes)
+        for i in range(count - 1):
+            next(codes)
+        if raw or not name.startswith('_'):
+            typ = '=' + _NPTYPES[code]
+        else:
+            name, typ = name[1:], '=i8'
+        fields.append((name, typ) if count == 1 else (name, typ, (count,)))
+    dtype = _npdtypes[key] = np.dtype(fields)
+    return dtype
+
+
+def nparray(cls, data, raw=False):
+    """将原始bin数据整体解析为numpy结构化数组, 不构造任何数据类对象
+
+    :param cls:  数据类
+    :param data: 原始bin数据, 若干条完整记录
+    :param raw:  是否保留XInt32原始值, 见npdtype
+    :returns: numpy结构化数组
+    """
+    if np is None:
+        raise ImportError('numpy is required for array output')
+    a = np.frombuffer(data, dtype=npdtype(cls))
+    if raw:
+        return a
+    out = np.empty(len(a), dtype=npdtype(cls, raw=False))
+    for name, count in cls.layout:
+        if name.startswith('_'):
+            out[name[1:]] = xint32array(a[name])
+        else:
+            out[name] = a[name]
+    return out
 
 
 def dataclasscommon(cls):
     """数据类通用方法装饰器
 
     """
+    cls.struct = struct.Struct(cls.fmt)
+
+    # timekey 中各字段在解包元组中的位置
+    pos = 0
+    fieldpos = {}
+    for name, count in cls.layout:
+        fieldpos[name] = pos
+        pos += count
+    cls.timekeyidx = tuple(fieldpos[name] for name in cls.timekey)
+
     @classmethod
     def _getsize(kls):
-        return struct.calcsize(kls.fmt)
+        return kls.struct.size
 
     cls.getsize = _getsize
 
+    if not hasattr(cls, 'fromtuple'):
+        @classmethod
+        def _fromtuple(kls, t):
+            obj = kls()
+            obj.readtuple(t)
+            return obj
+
+        cls.fromtuple = _fromtuple
+
+    @classmethod
+    def _frombytes(kls, data):
+        return kls.fromtuple(kls.struct.unpack(data))
+
+    cls.frombytes = _frombytes
+
     def _str(obj):
         fields = []
-        od = vars(obj)
         for i in obj.brieflist:
-            if i in od:
-                fields.append("{0:4}:{1:<12}".format(i, od[i]))
+            if hasattr(obj, i):
+                fields.append("{0:4}:{1:<12}".format(i, getattr(obj, i)))
         return "".join(fields)
 
     cls.__str__ =  _str
@@ -52,11 +208,70 @@ def dataclasscommon(cls):
     return cls
 
 
+def compactclass(cls):
+    """由数据类生成紧凑的只读记录类
+
+    记录以tuple保存, 元素与fmt逐项对应, 没有__dict__, 也不为数组字段分配
+    list. layout中的字段以属性访问: 数组字段展开为 name0, name1 ... 并以
+    name 属性返回list; XInt32字段(下划线开头)另有去掉下划线的属性返回解析
+    后的值. 支持 fromtuple(), frombytes(), pack(), 以及dataclasscommon的
+    __str__.
+
+    :param cls: 数据类, Day, Minute, Bargain, HisMin
+    :returns: 新的记录类, 类名为 'Compact' + cls.__name__
+    """
+    ns = {
+        '__slots__': (),
+        '__doc__': '{0}的紧凑只读版本, 见compactclass'.format(cls.__name__),
+        'fmt': cls.fmt,
+        'brieflist': cls.brieflist,
+        'layout': cls.layout,
+        'timekey': cls.timekey,
+    }
+    pos = 0
+    for name, count in cls.layout:
+        if count == 1:
+            ns[name] = property(itemgetter(pos))
+            if name.startswith('_'):
+                ns[name[1:]] = property(
+                    lambda self, i=pos: xint32value(self[i]))
+        else:
+            sl = slice(pos, pos + count)
+            for i in range(count):
+                ns['{0}{1}'.format(name, i)] = property(itemgetter(pos + i))
+            ns[name] = property(lambda self, sl=sl: list(self[sl]))
+            if name.startswith('_'):
+                ns[name[1:]] = property(
+                    lambda self, sl=sl: xint32values(self[sl]))
+        pos += count
+
+    @classmethod
+    def fromtuple(kls, t):
+        return tuple.__new__(kls, t)
+
+    def pack(self):
+        return self.struct.pack(*self)
+
+    ns['fromtuple'] = fromtuple
+    ns['pack'] = pack
+    return dataclasscommon(type('Compact' + cls.__name__, (tuple,), ns))
+
+
 @dataclasscommon
 class Day:
     """对应CPP中结构CDay"""
     fmt = '=23I2hi'
     brieflist = ['time', 'open', 'high', 'low', 'close', 'volume', 'amount']
+    # 记录按此时间键有序
+    timekey = ('time',)
+    # (字段名, 个数), 与fmt逐项对应, 下划线开头的为XInt32字段
+    layout = [
+        ('time', 1), ('open', 1), ('high', 1), ('low', 1), ('close', 1),
+        ('tradenum', 1), ('_volume', 1), ('_amount', 1), ('_neipan', 1),
+        ('buy', 1), ('sell', 1), ('_volbuy', 3), ('_volsell', 3),
+        ('_amtbuy', 3), ('_amtsell', 3), ('rise', 1), ('fall', 1),
+        ('reserve', 1),
+    ]
 
     def __init__(self):
         self.time = 0
@@ -87,6 +302,14 @@ class Day:
 
         :param data: 原始bin数据
 
+        """
+        self.readtuple(self.struct.unpack(data))
+
+    def readtuple(self, t):
+        """
+
+        :param t: 按fmt解包后的元组
+
         """
         (
             self.time,
@@ -115,17 +338,16 @@ class Day:
             self.rise,
             self.fall,
             self.reserve
-        ) = struct.unpack(self.fmt, data)
-        self.volume = xint32value(self._volume)
-        self.amount = xint32value(self._amount)
-        self.neipan = xint32value(self._neipan)
-        self.volbuy = [xint32value(x) for x in self._volbuy]
-        self.volsell = [xint32value(x) for x in self._volsell]
-        self.amtbuy = [xint32value(x) for x in self._amtbuy]
-        self.amtsell = [xint32value(x) for x in self._amtsell]
+        ) = t
+        v = xint32values(t[6:9] + t[11:23])
+        self.volume, self.amount, self.neipan = v[0:3]
+        self.volbuy = v[3:6]
+        self.volsell = v[6:9]
+        self.amtbuy = v[9:12]
+        self.amtsell = v[12:15]
 
     def pack(self):
-        return struct.pack(self.fmt,
+        return self.struct.pack(
             self.time,
             self.open,
             self.high,
@@ -171,6 +393,19 @@ class Minute:
     """对应CPP中结构CMinute"""
     fmt = '=66I2h3i'
     brieflist = ['time', 'close', 'ave', 'amount']
+    # 记录按此时间键有序
+    timekey = ('time',)
+    layout = [
+        ('time', 1), ('open', 1), ('high', 1), ('low', 1), ('close', 1),
+        ('volume', 1), ('_amount', 1), ('tradenum', 1), ('ave', 1),
+        ('buy', 1), ('sell', 1), ('volbuy', 1), ('volsell', 1),
+        ('order_numbuy', 4), ('order_numsell', 4), ('order_volbuy', 4),
+        ('order_volsell', 4), ('order_amtbuy', 4), ('order_amtsell', 4),
+        ('trade_numbuy', 4), ('trade_numsell', 4), ('trade_volbuy', 4),
+        ('trade_volsell', 4), ('trade_amtbuy', 4), ('trade_amtsell', 4),
+        ('neworder', 2), ('delorder', 2), ('strong', 1), ('rise', 1),
+        ('fall', 1), ('volsell5', 1), ('volbuy5', 1), ('count', 1),
+    ]
 
     def __init__(self):
         self.time = 0
@@ -203,6 +438,14 @@ class Minute:
 
         :param data: 原始bin数据
 
+        """
+        self.readtuple(self.struct.unpack(data))
+
+    def readtuple(self, t):
+        """
+
+        :param t: 按fmt解包后的元组
+
         """
         (
             self.time,
@@ -276,11 +519,11 @@ class Minute:
             self.volsell5,
             self.volbuy5,
             self.count
-        ) = struct.unpack(self.fmt, data)
+        ) = t
         self.amount = xint32value(self._amount)
 
     def pack(self):
-        return struct.pack(self.fmt,
+        return self.struct.pack(
             self.time,
             self.open,
             self.high,
@@ -360,6 +603,12 @@ class Bargain:
     """对应CPP中结构CBargain"""
     fmt = '=5Ib'
     brieflist = ['date', 'time', 'price', 'volume', 'tradenum', 'bs']
+    # 记录按此时间键有序
+    timekey = ('date', 'time')
+    layout = [
+        ('date', 1), ('time', 1), ('price', 1), ('_volume', 1),
+        ('tradenum', 1), ('bs', 1),
+    ]
 
     def __init__(self):
         self.date = 0
@@ -375,6 +624,14 @@ class Bargain:
 
         :param data: 原始bin数据
 
+        """
+        self.readtuple(self.struct.unpack(data))
+
+    def readtuple(self, t):
+        """
+
+        :param t: 按fmt解包后的元组
+
         """
         (
             self.date,
@@ -383,11 +640,11 @@ class Bargain:
             self._volume,
             self.tradenum,
             self.bs
-        ) = struct.unpack(self.fmt, data)
+        ) = t
         self.volume = xint32value(self._volume)
 
     def pack(self):
-        return struct.pack(self.fmt,
+        return self.struct.pack(
             self.date,
             self.time,
             self.price,
@@ -402,6 +659,11 @@ class HisMin:
     """对应CPP中结构CHisMin"""
     fmt = '=5I'
     brieflist = ['time', 'price', 'ave', 'volume', 'zjjl']
+    # 记录按此时间键有序
+    timekey = ('time',)
+    layout = [
+        ('time', 1), ('price', 1), ('ave', 1), ('_volume', 1), ('_zjjl', 1),
+    ]
 
     def __init__(self):
         self.time = 0
@@ -417,6 +679,14 @@ class HisMin:
 
         :param data: 原始bin数据
 
+        """
+        self.readtuple(self.struct.unpack(data))
+
+    def readtuple(self, t):
+        """
+
+        :param t: 按fmt解包后的元组
+
         """
         (
             self.time,
@@ -424,12 +694,11 @@ class HisMin:
             self.ave,
             self._volume,
             self._zjjl
-        ) = struct.unpack(self.fmt, data)
-        self.volume = xint32value(self._volume)
-        self.zjjl = xint32value(self._zjjl)
+        ) = t
+        self.volume, self.zjjl = xint32values((self._volume, self._zjjl))
 
     def pack(self):
-        return struct.pack(self.fmt,
+        return self.struct.pack(
             self.time,
             self.price,
             self.ave,
@@ -437,3 +706,9 @@ class HisMin:
             self._zjjl
         )
 
+
+
+CompactDay = compactclass(Day)
+CompactMinute = compactclass(Minute)
+CompactBargain = compactclass(Bargain)
+CompactHisMin = compactclass(HisMin)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+导出数据文件为可内存映射的列式格式
+
+npy:     目录下每个字段一个 <字段名>.npy, 另有 goodsids.npy, offsets.npy,
+         第i只股票的数据为各字段的 [offsets[i]:offsets[i + 1]], 可用
+         numpy.load(..., mmap_mode='r') 直接映射
+arrow:   Arrow IPC 文件, 需要pyarrow
+parquet: Parquet 文件, 需要pyarrow
+
+arrow, parquet 为一张表, 首列goodsid为每条记录所属的股票, 数组字段为定长list.
+XInt32字段都已解析.
+"""
+
+import os
+from .datatype import np
+
+
+def _pyarrow():
+    """pyarrow导入较慢, 只在导出arrow, parquet时才导入"""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('pyarrow is required for arrow and parquet export')
+    return pyarrow
+
+
+def exportnpy(goodsids, offsets, data, outdir):
+    """按字段写出 .npy 文件
+
+    :param goodsids: 股票id数组
+    :param offsets:  各股票数据的起始位置数组, 长度比goodsids多1
+    :param data:     numpy结构化数组
+    :param outdir:   输出目录, 不存在时创建
+    :returns: 写出的文件名列表
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    files = []
+    columns = [('goodsids', goodsids), ('offsets', offsets)] + \
+        [(name, data[name]) for name in data.dtype.names]
+    for name, column in columns:
+        filename = os.path.join(outdir, name + '.npy')
+        np.save(filename, np.ascontiguousarray(column))
+        files.append(filename)
+    return files
+
+
+def totable(goodsids, offsets, data):
+    """转换为pyarrow.Table, 参数同exportnpy"""
+    pyarrow = _pyarrow()
+    counts = np.diff(offsets)
+    names = ['goodsid']
+    arrays = [pyarrow.array(np.repeat(goodsids, counts))]
+    for name in data.dtype.names:
+        column = np.ascontiguousarray(data[name])
+        if column.ndim == 1:
+            arrays.append(pyarrow.array(column))
+        else:
+            flat = pyarrow.array(column.reshape(-1))
+            arrays.append(pyarrow.FixedSizeListArray.from_arrays(
+                flat, column.shape[1]))
+        names.append(name)
+    return pyarrow.Table.from_arrays(arrays, names=names)
+
+
+def exportarrow(goodsids, offsets, data, filename):
+    """写出Arrow IPC文件, 参数同exportnpy"""
+    pyarrow = _pyarrow()
+    table = totable(goodsids, offsets, data)
+    with pyarrow.OSFile(filename, 'wb') as sink:
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return [filename]
+
+
+def exportparquet(goodsids, offsets, data, filename):
+    """写出Parquet文件, 参数同exportnpy"""
+    _pyarrow().parquet.write_table(totable(goodsids, offsets, data), filename)
+    return [filename]
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+命令行输出格式
+
+text:   与数据类的__str__相同, 每只股票前有 id:<goodsid> 行
+csv:    首行为表头, 每行以goodsid开始, 数组字段展开为 name0, name1 ...
+jsonl:  每行一个JSON对象, 含goodsid, 数组字段为list
+binary: 每只股票为 struct '=2I' (goodsid, 记录数) 后接按数据类fmt打包的
+        原始记录, 总是输出整条记录
+
+输出多个文件时以文件名标记: text先输出 file:<文件名> 行, csv首列为file,
+jsonl含file键; binary不支持.
+
+记录按元组(见datatype.compactclass)逐批处理: 一只股票的数据按字段取出整列,
+XInt32字段整列解析, 再用预先生成的格式串一次格式化, 攒够bufsize字节再写出.
+"""
+
+import json
+import struct
+from itertools import repeat
+from operator import itemgetter
+from .datatype import xint32values
+
+
+OUTPUT_FORMATS = ('text', 'csv', 'jsonl', 'binary')
+
+_BINARY_HEAD = struct.Struct('=2I')
+
+
+def fieldspec(datacls, fields=None):
+    """解析要输出的字段
+
+    :param datacls: 数据类
+    :param fields:  字段名序列, XInt32字段不带下划线; 缺省为数据类的brieflist,
+                    其中layout没有的字段忽略, 与__str__一致
+    :returns: (字段名, 在记录元组中的位置, 个数, 是否XInt32) 元组的list
+    """
+    layout = {}
+    pos = 0
+    for name, count in datacls.layout:
+        xint = name.startswith('_')
+        layout[name.lstrip('_')] = (pos, count, xint)
+        pos += count
+    if fields is None:
+        return [(name,) + layout[name] for name in datacls.brieflist
+                if name in layout]
+    spec = []
+    for name in fields:
+        if name not in layout:
+            raise ValueError('unknown field of {0}: {1}'.format(
+                datacls.__name__, name))
+        spec.append((name,) + layout[name])
+    return spec
+
+
+def _columns(records, spec, expand=False):
+    """按spec从记录元组中取出各字段的整列, XInt32字段整列解析
+
+    :param expand: 数组字段是否展开为多列, 否则每个值为list
+    """
+    columns = []
+    for name, pos, count, xint in spec:
+        if count == 1:
+            column = list(map(itemgetter(pos), records))
+            columns.append(xint32values(column) if xint else column)
+            continue
+        if expand:
+            for i in range(pos, pos + count):
+                column = list(map(itemgetter(i), records))
+                columns.append(xint32values(column) if xint else column)
+            continue
+        sl = slice(pos, pos + count)
+        if xint:
+            columns.append([xint32values(r[sl]) for r in records])
+        else:
+            columns.append([list(r[sl]) for r in records])
+    return columns
+
+
+class RecordWriter:
+    """按批格式化记录并缓冲写出
+
+    usage:
+
+        >>> writer = RecordWriter(sys.stdout.buffer, CompactDay, 'csv')
+        >>> for gid, tms in df.items():
+                writer.write(gid, tms)
+        >>> writer.close()
+    """
+    def __init__(self, out, datacls, fmt='text', fields=None, bufsize=1 << 20,
+                 filename=None, header=True):
+        """
+        :param out:      二进制输出流, 如sys.stdout.buffer
+        :param datacls:  数据类, 记录为按其fmt解包的元组或Compact记录
+        :param fmt:      输出格式, 见OUTPUT_FORMATS
+        :param fields:   输出字段名序列, 见fieldspec; binary格式不可指定
+        :param bufsize:  缓冲字节数, 超过时写出
+        :param filename: 输出多个文件时标记记录所属的文件名
+        :param header:   csv格式是否输出表头, 多个文件时只有第一个输出
+        """
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError('unknown output format: {0}'.format(fmt))
+        if fmt == 'binary' and fields is not None:
+            raise ValueError('binary output always writes whole records')
+        if fmt == 'binary' and filename is not None:
+            raise ValueError('binary output does not support multiple files')
+        self.out = out
+        self.datacls = datacls
+        self.fmt = fmt
+        self.bufsize = bufsize
+        self.spec = fieldspec(datacls, fields)
+        self._chunks = []
+        self._size = 0
+        # 每行记录前的常量列, 与goodsid一起作为格式串的前几个参数
+        self._lead = []
+        if fmt == 'text':
+            if filename is not None:
+                self._append('file:{0}\n'.format(filename).encode())
+            self._template = ''.join(
+                '{0:4}:{{{1}:<12}}'.format(name, i) if count == 1 else
+                '{0:4}:{{{1}!s:<12}}'.format(name, i)
+                for i, (name, pos, count, xint) in enumerate(self.spec)) + '\n'
+        elif fmt == 'csv':
+            names = ['goodsid']
+            if filename is not None:
+                names.insert(0, 'file')
+                self._lead.append(filename)
+            for name, pos, count, xint in self.spec:
+                if count == 1:
+                    names.append(name)
+                else:
+                    names.extend('{0}{1}'.format(name, i) for i in range(count))
+            if header:
+                self._append((','.join(names) + '\n').encode())
+            self._template = ','.join(
+                '{{{0}}}'.format(i) for i in range(len(names))) + '\n'
+        elif fmt == 'jsonl':
+            names = ['goodsid'] + [spec[0] for spec in self.spec]
+            if filename is not None:
+                names.insert(0, 'file')
+                self._lead.append(json.dumps(filename))
+            self._template = '{{' + ','.join(
+                '"{0}":{{{1}}}'.format(name, i)
+                for i, name in enumerate(names)) + '}}\n'
+
+    def write(self, goodsid, records, tag=True):
+        """写入一只股票的一批记录
+
+        :param goodsid: 股票id
+        :param records: 记录元组序列
+        :param tag:     text格式时是否先输出 id:<goodsid> 行
+        """
+        if self.fmt == 'binary':
+            pack = self.datacls.struct.pack
+            records = list(records)
+            data = _BINARY_HEAD.pack(goodsid, len(records)) + \
+                b''.join([pack(*r) for r in records])
+            self._append(data)
+            return
+        if not isinstance(records, list):
+            records = list(records)
+        lines = []
+        if self.fmt == 'text':
+            if tag:
+                lines.append('id:{0}\n'.format(goodsid))
+            if records:
+                columns = _columns(records, self.spec)
+                lines.extend(map(self._template.format, *columns))
+        elif records:
+            columns = _columns(records, self.spec, self.fmt == 'csv')
+            lead = [repeat(value) for value in self._lead]
+            lines.extend(map(self._template.format, *(
+                lead + [repeat(goodsid)] + columns)))
+        if lines:
+            self._append(''.join(lines).encode())
+
+    def _append(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        """写出缓冲的数据"""
+        if self._chunks:
+            self.out.write(b''.join(self._chunks))
+            self._chunks = []
+            self._size = 0
+        self.out.flush()
+
+    def close(self):
+        """写出剩余数据, 不关闭out"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
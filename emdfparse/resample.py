@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+由分时(Minute)或成交(Bargain)数据生成K线, 记录格式与Day相同
+
+interval 为分钟数(如5, 15, 30)或 'day'. 一根K线包含 (结束时间 - interval,
+结束时间] 内的数据, 不跨日, 分钟K线的time为结束时间 YYMMDDHHMM, 日线为
+YYYYMMDD. Minute的time为 YYMMDDHHMM, 一条记录为截至该分钟的一分钟;
+Bargain的date, time 为 YYYYMMDD, HHMMSS. 当日成交文件(如Bargain.dat_1)
+中的date为0, 此时须以date参数给出日期.
+
+生成的字段: time, open, high, low, close, tradenum, volume, amount, 其余为0.
+volume, amount 为XInt32字段, 按解析后的值求和再编码, 超过28位时精度降低,
+与原始文件相同. Bargain没有成交额, amount按 sum(price * volume) / pricescale
+计算.
+
+有numpy时每只股票整体解析为数组后向量化计算(resamplearray), 否则逐条聚合
+(iterbars). 两者结果相同.
+"""
+
+from .datatype import np, npdtype, Day, Minute, Bargain, xint32encode, \
+    xint32encodearray
+from .datafile import DataFileBuilder
+
+
+# 价格的倍数, 3403245 表示 3403.245
+PRICE_SCALE = 1000
+
+def _sourcekind(datacls):
+    """'minute' 或 'bargain', 其他数据类不能生成K线
+
+    按fmt判断, Compact版本与原数据类相同
+    """
+    if datacls.fmt == Minute.fmt:
+        return 'minute'
+    if datacls.fmt == Bargain.fmt:
+        return 'bargain'
+    raise ValueError('cannot resample {0}, Minute or Bargain data expected'
+                     .format(datacls.__name__))
+
+
+def _step(interval):
+    """K线周期秒数, 日线为0"""
+    if interval == 'day':
+        return 0
+    if isinstance(interval, int) and interval > 0:
+        return interval * 60
+    raise ValueError('interval must be minutes or \'day\': {0!r}'.format(
+        interval))
+
+
+def _seconds(hhmmss):
+    return hhmmss // 10000 * 3600 + hhmmss // 100 % 100 * 60 + hhmmss % 100
+
+
+def _minutetime(time):
+    """Minute的time(YYMMDDHHMM)拆分为 (YYYYMMDD, 当日秒数)"""
+    hhmm = time % 10000
+    return 20000000 + time // 10000, (hhmm // 100 * 60 + hhmm % 100) * 60
+
+
+def _nodate():
+    return ValueError('Bargain records without date, pass date=YYYYMMDD')
+
+
+def iterbars(datacls, records, interval, pricescale=PRICE_SCALE, date=None):
+    """逐条聚合, 一次遍历按时间有序的记录, 生成K线
+
+    :param datacls:    records的数据类, Minute, Bargain 或其Compact版本
+    :param records:    时序数据, 如getgoodstms的结果
+    :param interval:   分钟数或 'day'
+    :param pricescale: Bargain计算成交额时price的倍数
+    :param date:       Bargain中date为0的记录的日期 YYYYMMDD
+    :returns: 按Day的fmt排列的元组的生成器, 可用 Day.fromtuple 构造
+    """
+    kind = _sourcekind(datacls)
+    step = _step(interval)
+    bar = None
+    key = None
+    for r in records:
+        if kind == 'minute':
+            day, sec = _minutetime(r.time)
+            high, low = r.high, r.low
+            fields = (r.open, r.close, r.volume, r.amount, r.tradenum)
+        else:
+            day, sec = r.date or date, _seconds(r.time)
+            if day is None:
+                raise _nodate()
+            high = low = r.price
+            fields = (r.price, r.price, r.volume, r.price * r.volume,
+                      r.tradenum)
+        k = (day, -(-sec // step)) if step else (day, 0)
+        if k != key:
+            if bar is not None:
+                yield _bartuple(kind, key, step, bar, pricescale)
+            key = k
+            bar = [fields[0], high, low, fields[1], fields[2], fields[3],
+                   fields[4]]
+            continue
+        if high > bar[1]:
+            bar[1] = high
+        if low < bar[2]:
+            bar[2] = low
+        bar[3] = fields[1]
+        bar[4] += fields[2]
+        bar[5] += fields[3]
+        bar[6] += fields[4]
+    if bar is not None:
+        yield _bartuple(kind, key, step, bar, pricescale)
+
+
+def _bartuple(kind, key, step, bar, pricescale):
+    day, bucket = key
+    if step:
+        end = bucket * step
+        time = day % 1000000 * 10000 + end // 3600 * 100 + end // 60 % 60
+    else:
+        time = day
+    opn, high, low, close, volume, amount, tradenum = bar
+    if kind == 'bargain':
+        amount //= pricescale
+    return (time, opn, high, low, close, tradenum, xint32encode(volume),
+            xint32encode(amount)) + (0,) * 18
+
+
+def resamplearray(datacls, a, interval, pricescale=PRICE_SCALE, date=None):
+    """向量化生成K线, 参数同iterbars
+
+    :param a: getgoodsarray(goodsid)的结果, XInt32字段已解析
+    :returns: Day的原始结构化数组(npdtype(Day)), 可直接写入DataFileBuilder
+    """
+    if np is None:
+        raise ImportError('numpy is required for array resampling')
+    kind = _sourcekind(datacls)
+    step = _step(interval)
+    if not len(a):
+        return np.zeros(0, dtype=npdtype(Day))
+    if kind == 'minute':
+        day, sec = _minutetime(a['time'].astype(np.int64))
+        opens, highs, lows, closes = a['open'], a['high'], a['low'], a['close']
+        volume = a['volume'].astype(np.int64)
+        amount = a['amount']
+    else:
+        day = a['date'].astype(np.int64)
+        if not day.all():
+            if date is None:
+                raise _nodate()
+            day[day == 0] = date
+        sec = _seconds(a['time'].astype(np.int64))
+        opens = highs = lows = closes = a['price']
+        volume = a['volume']
+        amount = a['price'].astype(np.int64) * volume
+    bucket = -(-sec // step) if step else np.zeros_like(sec)
+    key = day * 86400 + bucket
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    ends = np.r_[starts[1:], len(a)]
+
+    out = np.zeros(len(starts), dtype=npdtype(Day))
+    if step:
+        end = bucket[starts] * step
+        out['time'] = day[starts] % 1000000 * 10000 + end // 3600 * 100 + \
+            end // 60 % 60
+    else:
+        out['time'] = day[starts]
+    out['open'] = opens[starts]
+    out['high'] = np.maximum.reduceat(highs, starts)
+    out['low'] = np.minimum.reduceat(lows, starts)
+    out['close'] = closes[ends - 1]
+    out['tradenum'] = np.add.reduceat(a['tradenum'].astype(np.int64), starts)
+    out['_volume'] = xint32encodearray(np.add.reduceat(volume, starts))
+    amount = np.add.reduceat(amount, starts)
+    if kind == 'bargain':
+        amount //= pricescale
+    out['_amount'] = xint32encodearray(amount)
+    return out
+
+
+def resample(df, goodsid, interval, outcls=Day, pricescale=PRICE_SCALE,
+             date=None):
+    """生成一只股票的K线
+
+    :param df:      Minute或Bargain数据的DataFile
+    :param goodsid: 股票id
+    :param outcls:  K线的数据类, Day 或 CompactDay
+    :param date:    Bargain中date为0的记录的日期, 见iterbars
+    :returns: outcls对象的list
+    """
+    if np is not None:
+        bars = resamplearray(df.datacls, df.getgoodsarray(goodsid), interval,
+                             pricescale, date)
+        return list(map(outcls.fromtuple, Day.struct.iter_unpack(
+            bars.tobytes())))
+    return list(map(outcls.fromtuple, iterbars(
+        df.datacls, df.getgoodstms(goodsid), interval, pricescale, date)))
+
+
+def resamplefile(df, filename, interval, goodsids=None, version=1,
+                 pricescale=PRICE_SCALE, date=None):
+    """生成整个文件的K线, 写出Day格式的新数据文件, 如由Minute.dat生成Min5.dat
+
+    :param df:       Minute或Bargain数据的DataFile
+    :param filename: 新文件名, 已存在时覆盖
+    :param goodsids: 股票id序列, 缺省为全部
+    :param version:  1: EM_DataFile, 2: EM_DataFile2
+    :param date:     Bargain中date为0的记录的日期, 见iterbars
+    :returns: K线总数
+    """
+    if goodsids is None:
+        goodsids = list(df.goodsidx)
+    total = 0
+    with DataFileBuilder(filename, Day, version) as builder:
+        for goodsid in goodsids:
+            if np is not None:
+                bars = resamplearray(df.datacls, df.getgoodsarray(goodsid),
+                                     interval, pricescale, date)
+                total += len(bars)
+            else:
+                pack = Day.struct.pack
+                bars = b''.join([pack(*t) for t in iterbars(
+                    df.datacls, df.getgoodstms(goodsid), interval, pricescale,
+                    date)])
+                total += len(bars) // Day.getsize()
+            builder.add(goodsid, bars)
+    return total
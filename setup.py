@@ -33,6 +33,9 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     install_requires=requires,
+    extras_require={
+        "numpy": ["numpy"],
+    },
     entry_points=entry_points,
     classifiers=[
         'Development Status :: 4 - Beta',
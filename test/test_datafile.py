@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from emdfparse.cache import SeriesCache
+from emdfparse.datafile import DataFile, DataFileBuilder, DataFileHead, \
+    packblocks, packrecords, safewrite, DF_BLOCK_SIZE, SIZEOF_DATA_FILE_HEAD, \
+    INDEX_SUFFIX
+from emdfparse.datatype import Day, Bargain, np
+
+
+def days(first, n):
+    """n条time从first开始递增的Day记录"""
+    return [Day.fromtuple((first + i, 0, 0, 0, i) + (0,) * 21)
+            for i in range(n)]
+
+
+def writechains(filename, goods):
+    """按给定的块号列表写出数据文件
+
+    :param goods: (goodsid, 块号列表, Day记录list) 序列
+    """
+    datasize = Day.getsize()
+    bodysize = (DF_BLOCK_SIZE - 4) // datasize * datasize
+    head = DataFileHead()
+    head.info.version = 1
+    head.info.goodsnum = len(goods)
+    total = max(max(blocks) for goodsid, blocks, tms in goods) + 1
+    head.info.blockstotal = head.info.blocksuse = total
+    lock = threading.RLock()
+    f = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        os.ftruncate(f, total * DF_BLOCK_SIZE)
+        for index, (goodsid, blocks, tms) in enumerate(goods):
+            data = packrecords(Day, tms)
+            for blockid, buf in packblocks(blocks, data, DF_BLOCK_SIZE,
+                                           bodysize):
+                safewrite(lock, f, buf, blockid * DF_BLOCK_SIZE)
+            dfg = head.dfgs[index]
+            dfg.goodsid = goodsid
+            dfg.datanum = len(tms)
+            dfg.blockfirst = blocks[0]
+            dfg.blockdata = dfg.blocklast = blocks[-1]
+            dfg.datalastidx = tms[-1].time
+        safewrite(lock, f, head.pack(), 0)
+    finally:
+        os.close(f)
+
+
+def bargains(dates, n):
+    """每个日期n条Bargain记录, time从9:30:00起每秒一条"""
+    return [Bargain.fromtuple((date, 93000 + i // 60 * 100 + i % 60, i, 100,
+                               1, 1))
+            for date in dates for i in range(n)]
+
+
+def times(records):
+    return [r.time for r in records]
+
+
+class GappedChainTest(unittest.TestCase):
+    """两只股票的数据块交错存放, 链表在预读缓冲区内跳过其他股票的块"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'Day.dat')
+        first = SIZEOF_DATA_FILE_HEAD // DF_BLOCK_SIZE
+        # 每块81条, goods 1 共7块507条, 第4块后跳过goods 2的一块
+        self.goods = [
+            (1, [first + i for i in (0, 1, 2, 3, 5, 6, 7)],
+             days(1, 507)),
+            (2, [first + i for i in (4, 8, 9)], days(10000, 200)),
+            (3, [first + 11] + [first + i for i in range(13, 19)],
+             days(20000, 500)),
+        ]
+        writechains(self.filename, self.goods)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, df):
+        for goodsid, blocks, tms in self.goods:
+            self.assertEqual(times(df[goodsid]), times(tms))
+            if np is not None:
+                self.assertEqual(list(df.getgoodsarray(goodsid)['time']),
+                                 times(tms))
+        self.assertEqual(df.stats().chainbreaks, 0)
+
+    def test_pread(self):
+        self.check(DataFile(self.filename, Day))
+
+    def test_mmap(self):
+        df = DataFile(self.filename, Day, usemmap=True)
+        self.assertIsNotNone(df._mm)
+        self.check(df)
+
+    def test_compact(self):
+        newfile = os.path.join(self.tmpdir, 'Day.compact')
+        DataFile(self.filename, Day).compact(newfile)
+        self.check(DataFile(newfile, Day))
+
+    def test_compact_short_chain(self):
+        # 链表在goods 1的第3块后中断
+        df = DataFile(self.filename, Day, mode='w')
+        df.writeat(b'\xff\xff\xff\x7f', self.goods[0][1][2] * DF_BLOCK_SIZE)
+        newfile = os.path.join(self.tmpdir, 'Day.compact')
+        with self.assertRaises(ValueError):
+            df.compact(newfile)
+
+    def test_short_chain_stats(self):
+        df = DataFile(self.filename, Day, mode='w')
+        df.writeat(b'\xff\xff\xff\x7f', self.goods[0][1][2] * DF_BLOCK_SIZE)
+        self.assertEqual(len(df.tail(1, 300)), 0)
+        self.assertEqual(df.stats().chainbreaks, 2)
+        df.stats(reset=True)
+        self.assertEqual(len(df.tail(2, 10)), 10)
+        self.assertEqual(df.stats().blocks, 1)
+
+    def test_broken_first_block(self):
+        # goods 1的第1块即中断, 不缓存空的链表
+        df = DataFile(self.filename, Day, mode='w')
+        df.writeat(b'\xff\xff\xff\x7f', self.goods[0][1][0] * DF_BLOCK_SIZE)
+        for i in range(2):
+            self.assertEqual(df.tail(1, 200), [])
+            self.assertEqual(list(df.getgoodstms(1, 0)), [])
+            with self.assertRaises(ValueError):
+                df.appendgoodstms(1, [])
+        self.assertGreater(df.stats().chainbreaks, 0)
+
+    def test_write_short_chain(self):
+        df = DataFile(self.filename, Day, mode='w')
+        df.writeat(b'\xff\xff\xff\x7f', self.goods[0][1][2] * DF_BLOCK_SIZE)
+        with open(self.filename, 'rb') as f:
+            before = f.read()
+        with self.assertRaises(ValueError):
+            df.appendgoodstms(1, days(600, 10))
+        with self.assertRaises(ValueError):
+            df.setgoodstms(1, days(600, 10))
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+
+class WriteTest(unittest.TestCase):
+    """setgoodstms, appendgoodstms 写入后重新打开读取"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'Day.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_set_append_reopen(self):
+        df = DataFile(self.filename, Day, mode='w')
+        df.setgoodstms(1, days(1, 100))
+        df.appendgoodstms(1, days(101, 50))
+        df[2] = days(1000, 10)
+        df.appendgoodstms(2, days(1010, 200))
+        df.setgoodstms(1, days(5, 3))
+        df = DataFile(self.filename, Day)
+        self.assertEqual(times(df[1]), list(range(5, 8)))
+        self.assertEqual(times(df[2]), list(range(1000, 1210)))
+        self.assertEqual(times(df.tail(2, 5)), list(range(1205, 1210)))
+
+    def test_append_generator(self):
+        df = DataFile(self.filename, Day, mode='w')
+        df.appendgoodstms(424242, (r for r in days(1, 300)))
+        df.appendgoodstms(424242, (r for r in days(301, 20)))
+        df = DataFile(self.filename, Day)
+        self.assertEqual(times(df[424242]), list(range(1, 321)))
+
+    @unittest.skipIf(np is None, 'numpy is required')
+    def test_empty_filearray(self):
+        df = DataFile(self.filename, Day, mode='w')
+        for processes in (None, 2):
+            ids, offsets, data = df.getfilearray(processes=processes)
+            self.assertEqual((len(ids), list(offsets), len(data)), (0, [0], 0))
+
+    def test_follow_checkpoint(self):
+        df = DataFile(self.filename, Day, mode='w')
+        df.setgoodstms(1, days(1, 10))
+        reader = DataFile(self.filename, Day)
+        follow = reader.follow(interval=0)
+        df.appendgoodstms(1, days(11, 5))
+        goodsid, records = next(follow)
+        self.assertEqual(goodsid, 1)
+        self.assertEqual(times(records), list(range(11, 16)))
+
+
+class RangeTest(unittest.TestCase):
+    """按时间范围读取, tail, 旁路索引和缓存"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'Day.dat')
+        # 每块81条, 各块首条记录的time为 1, 82, 163, ...
+        DataFile(self.filename, Day, mode='w').setgoodstms(1, days(1, 507))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, df):
+        self.assertEqual(times(df[1, 82:163]), list(range(82, 164)))
+        self.assertEqual(times(df[1, 163:]), list(range(163, 508)))
+        self.assertEqual(times(df[1, :82]), list(range(1, 83)))
+        self.assertEqual(times(df[1, 80:83]), [80, 81, 82, 83])
+        self.assertEqual(times(df[1, 600:]), [])
+        self.assertEqual(times(df.tail(1, 100)), list(range(408, 508)))
+
+    def test_block_first_key(self):
+        self.check(DataFile(self.filename, Day))
+
+    def test_cached(self):
+        df = DataFile(self.filename, Day, cache=SeriesCache())
+        df[1]
+        self.check(df)
+        self.assertGreater(df.cache.hits, 0)
+
+    def test_bargain_prefix(self):
+        filename = os.path.join(self.tmpdir, 'Bargain.dat')
+        tms = bargains((20171016, 20171017, 20171018), 300)
+        DataFileBuilder(filename, Bargain).build({1: tms})
+
+        def keys(records):
+            return [(r.date, r.time) for r in records]
+
+        for cache in (None, SeriesCache()):
+            df = DataFile(filename, Bargain, cache=cache)
+            df[1]
+            self.assertEqual(keys(df[1, 20171017:20171017]),
+                             keys(r for r in tms if r.date == 20171017))
+            self.assertEqual(
+                keys(df[1, (20171017, 93100):(20171018, 93000)]),
+                [k for k in keys(tms)
+                 if (20171017, 93100) <= k <= (20171018, 93000)])
+            self.assertEqual(keys(df[1, :(20171016, 93459)]),
+                             [k for k in keys(tms) if k <= (20171016, 93459)])
+
+    def test_tail_two_blocks(self):
+        df = DataFile(self.filename, Day)
+        # 最后一块只有21条
+        self.assertEqual(times(df.tail(1, 21)), list(range(487, 508)))
+        self.assertEqual(times(df.tail(1, 22)), list(range(486, 508)))
+        df[1]
+        self.assertEqual(times(df.tail(1, 90)), list(range(418, 508)))
+
+    def test_stale_index(self):
+        df = DataFile(self.filename, Day, mode='w')
+        df.buildindex()
+        self.assertTrue(DataFile(self.filename, Day, useindex=True).blockindex)
+        df.appendgoodstms(1, days(508, 100))
+        self.assertTrue(os.path.exists(self.filename + INDEX_SUFFIX))
+        df = DataFile(self.filename, Day, useindex=True)
+        self.assertEqual(df.blockindex, {})
+        self.assertEqual(times(df[1]), list(range(1, 608)))
+        self.assertEqual(times(df.tail(1, 3)), [605, 606, 607])
+
+    def test_cache_then_append(self):
+        cache = SeriesCache()
+        df = DataFile(self.filename, Day, mode='w', cache=cache)
+        reader = DataFile(self.filename, Day, cache=cache)
+        self.assertEqual(len(df[1]), 507)
+        self.assertEqual(len(reader[1]), 507)
+        self.assertEqual(cache.hits, 1)
+        df.appendgoodstms(1, days(508, 10))
+        self.assertEqual(times(df[1, 500:]), list(range(500, 518)))
+        self.assertEqual(times(df.tail(1, 2)), [516, 517])
+        self.assertEqual(len(reader[1]), 507)
+        reader.refresh()
+        self.assertEqual(times(reader[1, 515:]), [515, 516, 517])
+        self.assertEqual(len(reader[1]), 517)
+
+
+if __name__ == '__main__':
+    unittest.main()
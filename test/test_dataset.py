@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import tempfile
+import unittest
+from emdfparse.datafile import DataFileBuilder
+from emdfparse.dataset import DataSet
+from emdfparse.datatype import Bargain
+
+
+def bargains(*keys):
+    """(date, time, price) 的Bargain记录list"""
+    return [Bargain.fromtuple((date, time, price, 100, 1, 1))
+            for date, time, price in keys]
+
+
+def prices(records):
+    return [r.price for r in records]
+
+
+class DataSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def dataset(self, *series):
+        filenames = []
+        for i, tms in enumerate(series):
+            filename = os.path.join(self.tmpdir, 'Bargain.dat_{0}'.format(i))
+            DataFileBuilder(filename, Bargain).build({1: tms})
+            filenames.append(filename)
+        return DataSet(filenames, Bargain)
+
+    def test_same_second_ticks(self):
+        ds = self.dataset(
+            bargains((20171016, 93000, 1), (20171016, 93000, 2),
+                     (20171016, 93001, 3)),
+            bargains((20171017, 93000, 4), (20171017, 93000, 5)))
+        self.assertEqual(prices(ds[1]), [1, 2, 3, 4, 5])
+        self.assertEqual(prices(ds.tail(1, 3)), [3, 4, 5])
+
+    def test_duplicates_prefer_earlier_file(self):
+        ds = self.dataset(
+            bargains((20171016, 93000, 1), (20171016, 93000, 2),
+                     (20171016, 93001, 3)),
+            bargains((20171016, 93000, 7), (20171016, 93001, 8),
+                     (20171016, 93002, 9), (20171016, 93002, 10)))
+        self.assertEqual(prices(ds[1]), [1, 2, 3, 9, 10])
+        self.assertEqual(prices(ds[1, 20171016:(20171016, 93001)]),
+                         [1, 2, 3])
+        self.assertEqual(prices(ds.tail(1, 2)), [9, 10])
+
+    def test_date_zero_concatenated(self):
+        ds = self.dataset(
+            bargains((20171016, 93000, 1), (20171016, 150000, 2)),
+            bargains((0, 91500, 3), (0, 93000, 4), (0, 93000, 5)))
+        self.assertEqual(prices(ds[1]), [1, 2, 3, 4, 5])
+        self.assertEqual(prices(ds.tail(1, 4)), [2, 3, 4, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import unittest
+from emdfparse.datatype import Day, Minute, Bargain, HisMin, CompactDay, \
+    CompactMinute, CompactBargain, nparray, np, xint32encode
+from emdfparse.resample import iterbars, resamplearray
+
+
+def minutes(*times):
+    """time为YYMMDDHHMM的Minute记录, 第i条的close为i, volume为100"""
+    return [CompactMinute.fromtuple(
+        (time, i, i + 1, i, i, 100, xint32encode(1000), 1) + (0,) * 63)
+        for i, time in enumerate(times)]
+
+
+def bargains(*keys):
+    """(date, time, price) 的Bargain记录list"""
+    return [CompactBargain.fromtuple((date, time, price, 10, 1, 1))
+            for date, time, price in keys]
+
+
+class SourceTest(unittest.TestCase):
+
+    def test_accepts_minute_and_bargain(self):
+        for cls in (Minute, CompactMinute, Bargain, CompactBargain):
+            self.assertEqual(list(iterbars(cls, [], 5)), [])
+
+    def test_rejects_other_classes(self):
+        for cls in (Day, CompactDay, HisMin):
+            with self.assertRaises(ValueError):
+                list(iterbars(cls, [], 5))
+
+
+class ResampleTest(unittest.TestCase):
+
+    def resample(self, datacls, records, interval, **kwargs):
+        """iterbars的结果, 有numpy时与resamplearray比较"""
+        bars = list(map(CompactDay.fromtuple,
+                        iterbars(datacls, records, interval, **kwargs)))
+        if np is not None:
+            data = b''.join(r.pack() for r in records)
+            a = resamplearray(datacls, nparray(datacls, data), interval,
+                              **kwargs)
+            self.assertEqual(a.tobytes(), b''.join(b.pack() for b in bars))
+        return bars
+
+    def test_minute_bars(self):
+        records = minutes(
+            2403220931, 2403220932, 2403220933, 2403220934, 2403220935,
+            2403220936, 2403220940, 2403221130, 2403221301, 2403221302,
+            2403221455, 2403221456, 2403221459, 2403221500)
+        bars = self.resample(CompactMinute, records, 5)
+        self.assertEqual([b.time for b in bars], [
+            2403220935, 2403220940, 2403221130, 2403221305, 2403221455,
+            2403221500])
+        self.assertEqual([b.volume for b in bars], [500, 200, 100, 200, 100,
+                                                    300])
+        self.assertEqual([(b.open, b.high, b.low, b.close) for b in bars[:2]],
+                         [(0, 5, 0, 4), (5, 7, 5, 6)])
+        self.assertEqual([b.amount for b in bars][-1], 3000)
+        bars = self.resample(CompactMinute, records, 'day')
+        self.assertEqual([b.time for b in bars], [20240322])
+        self.assertEqual(bars[0].close, 13)
+
+    def test_bargain_bars(self):
+        records = bargains((20171017, 93003, 100), (20171017, 93003, 101),
+                           (20171017, 93500, 102), (20171017, 93501, 99),
+                           (20171018, 93001, 98))
+        bars = self.resample(CompactBargain, records, 5)
+        self.assertEqual([b.time for b in bars],
+                         [1710170935, 1710170940, 1710180935])
+        self.assertEqual([b.volume for b in bars], [30, 10, 10])
+        self.assertEqual(bars[0].amount, 3)
+        bars = self.resample(CompactBargain, records, 'day')
+        self.assertEqual([b.time for b in bars], [20171017, 20171018])
+
+    def test_bargain_without_date(self):
+        records = bargains((0, 91500, 100), (0, 93003, 101))
+        with self.assertRaises(ValueError):
+            self.resample(CompactBargain, records, 'day')
+        bars = self.resample(CompactBargain, records, 'day', date=20171017)
+        self.assertEqual([b.time for b in bars], [20171017])
+        bars = self.resample(CompactBargain, records, 30, date=20171017)
+        self.assertEqual([b.time for b in bars], [1710170930, 1710171000])
+
+
+if __name__ == '__main__':
+    unittest.main()